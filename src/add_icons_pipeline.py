@@ -1,18 +1,41 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import timeit
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Iterator, List, Optional, Tuple
 
-from fuzzywuzzy import process
-import fontawesome as fa
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from transformers import TFMarianMTModel, MarianTokenizer, TranslationPipeline
 
-from data_processing_utilities import load_csv_as_df, export_df_as_csv
+from data_processing_utilities import (
+    load_csv_as_df,
+    export_df_as_csv,
+    encode_categorical_columns,
+    map_categorical_values,
+)
 from logging_utils import get_logger
 
 logger = get_logger(__name__)
 
+TRANSLATION_MODEL_NAME = "Helsinki-NLP/opus-mt-da-en"
+
+# Sentence ends: '.', '!' or '?' followed by whitespace and the start of a new sentence
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"(?<=[.!?])\s+(?=[A-ZÆØÅ0-9\"'(])")
+DANISH_ABBREVIATIONS = {"f.eks.", "fx.", "ca.", "bl.a.", "dvs.", "mht.", "evt.", "jf.", "osv.", "m.m.", "nr.", "pga.", "kr.", "f.kr.", "e.kr."}
+
+# Translator of a translation worker process, created once per process by init_translation_worker
+_worker_translator = None
+
 def find_most_similar_icon(value: str) -> str:
+    # Imported lazily, fuzzywuzzy and fontawesome are only needed for the icon search
+    from fuzzywuzzy import process
+    import fontawesome as fa
+
     # Get all icons from fontawesome
     icons = fa.icons
 
@@ -26,9 +49,10 @@ def icon_search_by_column_pipeline(
     df: pd.DataFrame, column_to_search: str, column_to_add: str = "fa-icon"
 ) -> pd.DataFrame:
     logger.info(f"Starting icon search from column {column_to_search} pipeline...")
-    tqdm.pandas()
-    # Create a new pandas Series by applying the find_most_similar_icon function to the 'en_anlaegsbetydning' column
-    icon_series = df[column_to_search].progress_apply(find_most_similar_icon)
+    # Create a new pandas Series by searching an icon once per distinct value of the 'en_anlaegsbetydning' column
+    icon_series = map_categorical_values(
+        df[column_to_search], find_most_similar_icon, progress_description="Searching icons"
+    )
 
     # Add this Series as a new column to the DataFrame, get the index of en_anlaegsbetydning, add 1 to it, so its just to the right
     df.insert(
@@ -42,35 +66,193 @@ def icon_search_by_column_pipeline(
     return df
 
 
+def create_translator():
+    # Imported lazily, loading transformers pulls in TensorFlow which takes seconds
+    from transformers import TFMarianMTModel, MarianTokenizer, TranslationPipeline
+
+    # Instantiate model and tokenizer, hardcoded to use model for Danish to English translation
+    model = TFMarianMTModel.from_pretrained(TRANSLATION_MODEL_NAME)
+    tokenizer = MarianTokenizer.from_pretrained(TRANSLATION_MODEL_NAME)
+
+    # Create a translation pipeline for Danish to English translation from model and tokenizer
+    return TranslationPipeline(model=model, tokenizer=tokenizer, framework="tf")
+
+
+def init_translation_worker(threads_per_worker: int, translator_factory: Callable = create_translator) -> None:
+    """
+    Limits the threads of a worker process before TensorFlow is loaded, then loads its own model instance.
+    """
+    global _worker_translator
+
+    for variable in ["OMP_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"]:
+        os.environ[variable] = str(threads_per_worker)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+
+    _worker_translator = translator_factory()
+
+
+def translate_shard(texts: List[str], batch_size: Optional[int] = 16) -> List[str]:
+    # Without a batch size the shard is translated as a single batch
+    results = _worker_translator(texts, batch_size=batch_size or len(texts))
+    return [result["translation_text"] for result in results]
+
+
+def get_shard_checkpoint_path(checkpoint_dir: Path, shard_id: int, texts: List[str]) -> Path:
+    # The shard content is part of the name, so checkpoints of different inputs never mix
+    shard_hash = hashlib.sha256(json.dumps(texts, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+    return checkpoint_dir / f"shard_{shard_id:05d}_{shard_hash}.json"
+
+
+def write_shard_checkpoint(checkpoint_path: Path, translations: List[str]) -> None:
+    # Write to a temporary file first, so a killed run never leaves a partial checkpoint
+    temporary_path = checkpoint_path.with_suffix(".tmp")
+    temporary_path.write_text(json.dumps(translations, ensure_ascii=False), encoding="utf-8")
+    temporary_path.replace(checkpoint_path)
+
+
+def checkpoint_when_done(checkpoint_path: Path) -> Callable[[Future], None]:
+    def callback(future: Future) -> None:
+        if future.exception() is None:
+            write_shard_checkpoint(checkpoint_path, future.result())
+
+    return callback
+
+
+def iter_translated_shards(
+    texts: List[str],
+    num_workers: int,
+    shard_size: int = 64,
+    threads_per_worker: int = 1,
+    checkpoint_dir: Optional[Path] = None,
+    translator_factory: Callable = create_translator,
+    token_counts: Optional[List[int]] = None,
+    max_tokens_per_batch: int = 2048,
+) -> Iterator[Tuple[List[str], List[str]]]:
+    """
+    Translates texts with a process pool, each worker holding its own model instance, and yields
+    (texts, translations) per shard in input order.
+
+    Every finished shard is checkpointed as soon as it completes, so a killed run resumes
+    from the shards that were already translated.
+
+    Parameters:
+        texts (List[str]): The texts to translate.
+        num_workers (int): The number of worker processes.
+        shard_size (int): The number of texts per shard. Default is 64.
+        threads_per_worker (int): The number of compute threads per worker. Default is 1,
+            so num_workers workers use num_workers cores.
+        checkpoint_dir (Optional[Path]): The directory for shard checkpoints. Default is None, no checkpointing.
+        translator_factory (Callable): Creates the translator of every worker, must be picklable. Default is create_translator.
+        token_counts (Optional[List[int]]): The token count of every text. If given, the shards are the batches of
+            batch_by_token_limit instead of shard_size texts, and every shard is translated as one batch.
+        max_tokens_per_batch (int): The largest number of input tokens per shard when token_counts is given. Default is 2048.
+    """
+    if token_counts is None:
+        shards = [texts[start:start + shard_size] for start in range(0, len(texts), shard_size)]
+        batch_size = 16
+    else:
+        shards = [[texts[position] for position in batch] for batch in batch_by_token_limit(token_counts, max_tokens_per_batch)]
+        batch_size = None
+
+    checkpoint_paths: List[Optional[Path]] = [None] * len(shards)
+    if checkpoint_dir is not None:
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        checkpoint_paths = [
+            get_shard_checkpoint_path(checkpoint_dir, shard_id, shard) for shard_id, shard in enumerate(shards)
+        ]
+
+    pending_shard_ids = [
+        shard_id for shard_id, path in enumerate(checkpoint_paths) if path is None or not path.exists()
+    ]
+    logger.info(
+        f"Translating {len(texts)} texts in {len(shards)} shards with {num_workers} workers, "
+        f"{len(shards) - len(pending_shard_ids)} shards restored from checkpoints"
+    )
+
+    # Spawned workers, forking a process that already loaded TensorFlow is not safe
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_translation_worker,
+        initargs=(threads_per_worker, translator_factory),
+    ) as executor:
+        futures = {}
+        for shard_id in pending_shard_ids:
+            future = executor.submit(translate_shard, shards[shard_id], batch_size)
+            if checkpoint_paths[shard_id] is not None:
+                future.add_done_callback(checkpoint_when_done(checkpoint_paths[shard_id]))
+            futures[shard_id] = future
+
+        for shard_id, shard in enumerate(tqdm(shards, desc="Translating shards")):
+            if shard_id in futures:
+                translations = futures[shard_id].result()
+            else:
+                translations = json.loads(checkpoint_paths[shard_id].read_text(encoding="utf-8"))
+            yield shard, translations
+
+
+def translate_texts_sharded(
+    texts: List[str],
+    num_workers: int,
+    shard_size: int = 64,
+    threads_per_worker: int = 1,
+    checkpoint_dir: Optional[Path] = None,
+    translator_factory: Callable = create_translator,
+    token_counts: Optional[List[int]] = None,
+    max_tokens_per_batch: int = 2048,
+) -> List[str]:
+    translations = []
+    for _, shard_translations in iter_translated_shards(
+        texts,
+        num_workers,
+        shard_size,
+        threads_per_worker,
+        checkpoint_dir,
+        translator_factory,
+        token_counts,
+        max_tokens_per_batch,
+    ):
+        translations.extend(shard_translations)
+    return translations
+
+
 def translate_dataframe_column_dk_to_en(
     df: pd.DataFrame,
     output_csv_path: Path,
     column_to_translate: str,
     translated_column_name: str = None,
     export_resulting_df: bool = False,
+    num_workers: int = 1,
+    checkpoint_dir: Optional[Path] = None,
 ) -> pd.DataFrame:
     # Dynamically construct column name if not provided
     if not translated_column_name:
         translated_column_name = f"En_{column_to_translate}"
 
-    # Instantiate model and tokenizer, hardcoded to use model for Danish to English translation
-    model = TFMarianMTModel.from_pretrained("Helsinki-NLP/opus-mt-da-en")
-    tokenizer = MarianTokenizer.from_pretrained("Helsinki-NLP/opus-mt-da-en")
-
-    # Create a translation pipeline for Danish to English translation from model and tokenizer
-    translator = TranslationPipeline(model=model, tokenizer=tokenizer, framework="tf")
+    logger.info(f"Starting translation of column {column_to_translate} from Danish to English...")
 
-    tqdm.pandas()
+    if num_workers > 1:
+        # Translate the distinct values across a process pool, then look the rows up by value
+        distinct_values = [str(value) for value in df[column_to_translate].astype("category").cat.categories]
+        translations = dict(
+            zip(
+                distinct_values,
+                translate_texts_sharded(distinct_values, num_workers, checkpoint_dir=checkpoint_dir),
+            )
+        )
+        translate_value = translations.__getitem__
+    else:
+        translator = create_translator()
+        translate_value = lambda text: translator(text)[0]["translation_text"]
 
-    logger.info(f"Starting translation of column {column_to_translate} from Danish to English...")
-    # Create a new pandas Series by applying the translator to every value from the specified column
-    english_translations = df[column_to_translate].progress_apply(
-        lambda text: translator(text)[0]["translation_text"]
+    # Create a new pandas Series by translating every distinct value from the specified column once,
+    # converting the encoding of the translated text from UTF-8 to ISO-8859-1 to match df encoding
+    english_translations = map_categorical_values(
+        df[column_to_translate],
+        lambda text: translate_value(str(text)).encode('utf-8').decode('ISO-8859-1', 'ignore'),
+        progress_description="Translating",
     )
 
-    # Convert the encoding of the translated text from UTF-8 to ISO-8859-1 to match df encoding
-    english_translations = english_translations.apply(lambda text: text.encode('utf-8').decode('ISO-8859-1', 'ignore'))
-
     # Add this Series as a new column to the DataFrame, get the index of the specified column, add 1 to it, so its just to the right
     df.insert(
         loc=df.columns.get_loc(column_to_translate) + 1,
@@ -84,6 +266,138 @@ def translate_dataframe_column_dk_to_en(
     return df
 
 
+def split_into_sentences(text: str) -> List[str]:
+    """
+    Splits Danish text into sentences at '.', '!' or '?' followed by whitespace and an uppercase letter or digit,
+    without splitting after common abbreviations such as 'f.eks.' or 'ca.'.
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_BOUNDARY_PATTERN.finditer(text):
+        preceding_words = text[start:match.start()].split()
+        if preceding_words and preceding_words[-1].lower() in DANISH_ABBREVIATIONS:
+            continue
+        sentences.append(text[start:match.start()].strip())
+        start = match.end()
+    sentences.append(text[start:].strip())
+    return [sentence for sentence in sentences if sentence]
+
+
+def batch_by_token_limit(token_counts: List[int], max_tokens_per_batch: int) -> List[List[int]]:
+    """
+    Groups items into batches whose token counts sum to at most max_tokens_per_batch.
+    An item longer than the limit gets a batch of its own.
+
+    Returns:
+        List[List[int]]: The positions of the items in every batch.
+    """
+    batches: List[List[int]] = []
+    current_batch: List[int] = []
+    current_tokens = 0
+    for position, token_count in enumerate(token_counts):
+        if current_batch and current_tokens + token_count > max_tokens_per_batch:
+            batches.append(current_batch)
+            current_batch, current_tokens = [], 0
+        current_batch.append(position)
+        current_tokens += token_count
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+
+def translate_long_text_column_dk_to_en(
+    df: pd.DataFrame,
+    column_to_translate: str,
+    translated_column_name: Optional[str] = None,
+    max_tokens_per_batch: int = 2048,
+    only_missing: bool = True,
+    num_workers: int = 1,
+    checkpoint_dir: Optional[Path] = None,
+) -> pd.DataFrame:
+    """
+    Translates a multi-sentence text column from Danish to English, stored next to the Danish column.
+
+    Texts are split into sentences, repeated sentences across rows are translated once, and the
+    distinct sentences are translated in batches within a token limit, sorted by length to keep
+    padding low. The translated sentences are joined back together per row.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame holding the column.
+        column_to_translate (str): The column with Danish text, e.g. 'definition'.
+        translated_column_name (Optional[str]): The column for the English text. Defaults to 'en_<column_to_translate>'.
+        max_tokens_per_batch (int): The largest number of input tokens per batch. Default is 2048.
+        only_missing (bool): Only translate rows without an existing translation. Default is True.
+        num_workers (int): Translate across this many processes, see translate_texts_sharded. Default is 1.
+        checkpoint_dir (Optional[Path]): The shard checkpoint directory when num_workers is above 1.
+
+    Returns:
+        pd.DataFrame: The DataFrame with the translated column.
+    """
+    if not translated_column_name:
+        translated_column_name = f"en_{column_to_translate}"
+
+    if translated_column_name not in df.columns:
+        df.insert(loc=df.columns.get_loc(column_to_translate) + 1, column=translated_column_name, value=None)
+    df[translated_column_name] = df[translated_column_name].astype(object)
+
+    rows_to_translate = df[column_to_translate].notna()
+    if only_missing:
+        rows_to_translate &= df[translated_column_name].isna()
+    texts = df.loc[rows_to_translate, column_to_translate].astype(str)
+
+    # Sentences per row, and the distinct sentences across all rows
+    sentences_per_row = texts.apply(split_into_sentences)
+    distinct_sentences = list(dict.fromkeys(sentence for sentences in sentences_per_row for sentence in sentences))
+    total_sentences = int(sentences_per_row.str.len().sum())
+    logger.info(
+        f"Translating {len(texts)} rows of column {column_to_translate}: {total_sentences} sentences, "
+        f"{len(distinct_sentences)} distinct"
+    )
+    if len(distinct_sentences) == 0:
+        return df
+
+    from transformers import MarianTokenizer
+
+    tokenizer = MarianTokenizer.from_pretrained(TRANSLATION_MODEL_NAME)
+    token_counts = np.array([len(input_ids) for input_ids in tokenizer(distinct_sentences)["input_ids"]])
+
+    # Sorting by length keeps sentences of similar length in one batch, which minimises padding
+    length_order = np.argsort(token_counts, kind="stable")
+    sorted_sentences = [distinct_sentences[position] for position in length_order]
+
+    start = timeit.default_timer()
+    if num_workers > 1:
+        # Every shard is one token-limited batch, so the workers keep to max_tokens_per_batch as well
+        sorted_translations = translate_texts_sharded(
+            sorted_sentences,
+            num_workers,
+            checkpoint_dir=checkpoint_dir,
+            token_counts=token_counts[length_order].tolist(),
+            max_tokens_per_batch=max_tokens_per_batch,
+        )
+    else:
+        translator = create_translator()
+        sorted_translations = []
+        for batch in tqdm(
+            batch_by_token_limit(token_counts[length_order].tolist(), max_tokens_per_batch), desc="Translating batches"
+        ):
+            results = translator([sorted_sentences[position] for position in batch], batch_size=len(batch))
+            sorted_translations.extend(result["translation_text"] for result in results)
+    duration = max(timeit.default_timer() - start, 1e-9)
+
+    logger.info(
+        f"Translated {int(token_counts.sum())} tokens in {duration:.1f} seconds "
+        f"({token_counts.sum() / duration:.1f} tokens/sec)"
+    )
+
+    translations = dict(zip(sorted_sentences, sorted_translations))
+    df.loc[rows_to_translate, translated_column_name] = sentences_per_row.apply(
+        lambda sentences: " ".join(translations[sentence] for sentence in sentences)
+    )
+
+    return df
+
+
 def main():
     input_csv_path = (
         Path(__file__).resolve().parents[1]
@@ -104,6 +418,7 @@ def main():
         columns_to_load=None,
         column_dtypes=None,
     )
+    df = encode_categorical_columns(df)
 
     df = translate_dataframe_column_dk_to_en(
         df=df,
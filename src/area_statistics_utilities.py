@@ -0,0 +1,168 @@
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from code_utilities import timing_decorator
+from data_processing_utilities import compute_anlaegsbetydning_statistics
+from logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+GRID_CELL_COLUMN = "grid_cell"
+GRID_CELL_SIZE_M = 10_000
+
+# Attribute names of the kommune, shapefile attribute names are truncated to 10 characters
+ADMIN_AREA_COLUMNS = ["kommunenavn", "kommunenav", "kommunenr"]
+
+
+def resolve_admin_area_column(columns: List[str]) -> Optional[str]:
+    return next((column for column in ADMIN_AREA_COLUMNS if column in columns), None)
+
+
+def assign_grid_cells(gdf: gpd.GeoDataFrame, cell_size_m: int = GRID_CELL_SIZE_M) -> pd.Series:
+    """
+    Assigns every monument to a square grid cell, named like the Danish kvadratnet, e.g. '10km_620_57'.
+
+    The representative point of each geometry decides the cell, so lines and polygons get one cell each.
+    The layer must be in a metric CRS such as EPSG:25832.
+
+    Returns:
+        pd.Series: The grid cell of every monument as a categorical.
+    """
+    points = gdf.geometry.representative_point()
+    x = points.x.to_numpy()
+    y = points.y.to_numpy()
+
+    # Missing and empty geometries have no coordinates, they get no cell
+    has_cell = np.isfinite(x) & np.isfinite(y)
+    cell_x = np.floor_divide(x[has_cell], cell_size_m).astype(np.int64)
+    cell_y = np.floor_divide(y[has_cell], cell_size_m).astype(np.int64)
+
+    # Name the distinct cells only, not every row
+    cell_keys, cell_codes = np.unique(np.stack([cell_y, cell_x], axis=1), axis=0, return_inverse=True)
+    cell_names = [f"{cell_size_m // 1000}km_{y}_{x}" for y, x in cell_keys]
+    codes = np.full(len(gdf), -1, dtype=np.int64)
+    codes[has_cell] = cell_codes.reshape(-1)
+    cells = pd.Categorical.from_codes(codes, categories=cell_names)
+    return pd.Series(cells, index=gdf.index, name=GRID_CELL_COLUMN)
+
+
+def assign_admin_areas(gdf: gpd.GeoDataFrame, areas_gdf: gpd.GeoDataFrame, area_column: str) -> pd.Series:
+    """
+    Assigns every monument to the admin area containing its representative point, through the spatial index of areas_gdf.
+
+    Only needed for layers without area attributes, monuments outside every area are left missing.
+    """
+    points = gpd.GeoDataFrame(geometry=gdf.geometry.representative_point(), crs=gdf.crs)
+    joined = gpd.sjoin(points, areas_gdf[[area_column, areas_gdf.geometry.name]].to_crs(gdf.crs), how="left", predicate="within")
+
+    # Points on a shared border fall within several areas, keep the first
+    joined = joined[~joined.index.duplicated(keep="first")]
+    return joined[area_column].astype("category").rename(area_column)
+
+
+def _to_json_value(value: Any) -> Any:
+    if isinstance(value, np.ndarray):
+        return [_to_json_value(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _to_json_value(item) for key, item in value.items()}
+    if isinstance(value, np.generic):
+        value = value.item()
+    # Groups without any datering have NaN statistics, which is not valid JSON
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+@timing_decorator(logger=logger)
+def compute_area_statistics(df: pd.DataFrame, area_columns: List[str]) -> pd.DataFrame:
+    """
+    Computes monument counts and datering distributions per area, with the same logic as the anlaegsbetydning statistics.
+
+    Parameters:
+        df (pd.DataFrame): The monuments, with a 'datering' column and the area columns.
+        area_columns (List[str]): The area columns to aggregate by, e.g. ['kommunenavn', 'grid_cell'].
+
+    Returns:
+        pd.DataFrame: One row per area with the columns 'area_type', 'area', 'counts',
+        'most_frequent_datering' and 'datering_distributions'.
+    """
+    statistics = []
+    for area_column in area_columns:
+        area_statistics_df = compute_anlaegsbetydning_statistics(df, group_column=area_column)
+        area_statistics_df = area_statistics_df.rename(columns={area_column: "area"})
+        area_statistics_df.insert(0, "area_type", area_column)
+        statistics.append(area_statistics_df)
+        logger.info(f"Computed statistics for {len(area_statistics_df)} areas of {area_column}")
+
+    return pd.concat(statistics, ignore_index=True)
+
+
+def export_area_statistics(area_statistics_df: pd.DataFrame, output_path: Path) -> None:
+    """
+    Writes the area statistics as a JSON lookup table, area type -> area -> statistics.
+    """
+    lookup: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for row in area_statistics_df.itertuples(index=False):
+        lookup.setdefault(row.area_type, {})[str(row.area)] = {
+            "counts": _to_json_value(row.counts),
+            "most_frequent_datering": _to_json_value(row.most_frequent_datering),
+            "datering_distributions": _to_json_value(row.datering_distributions),
+        }
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as file:
+        json.dump(lookup, file, ensure_ascii=False, separators=(",", ":"))
+    logger.info(f"Exported statistics of {len(area_statistics_df)} areas to {output_path}")
+
+
+def load_area_statistics(path: Path) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def build_area_statistics(
+    gdf: gpd.GeoDataFrame,
+    output_path: Path,
+    areas_gdf: Optional[gpd.GeoDataFrame] = None,
+    area_column: Optional[str] = None,
+    cell_size_m: int = GRID_CELL_SIZE_M,
+) -> gpd.GeoDataFrame:
+    """
+    Assigns the monuments to grid cells and admin areas, and exports the per-area statistics lookup table.
+
+    The admin area comes from the kommune attributes of the monuments if present, otherwise from a
+    spatial join with areas_gdf.
+
+    Parameters:
+        gdf (gpd.GeoDataFrame): The monuments in a metric CRS, with a 'datering' column.
+        output_path (Path): The path of the JSON lookup table.
+        areas_gdf (Optional[gpd.GeoDataFrame]): Admin area polygons, only used if the monuments have no kommune attribute.
+        area_column (Optional[str]): The admin area column. Defaults to the first kommune attribute found.
+        cell_size_m (int): The grid cell size in metres. Default is 10 km.
+
+    Returns:
+        gpd.GeoDataFrame: The monuments with the grid cell column added.
+    """
+    gdf = gdf.copy()
+    gdf[GRID_CELL_COLUMN] = assign_grid_cells(gdf, cell_size_m)
+    area_columns = [GRID_CELL_COLUMN]
+
+    if area_column is None:
+        area_column = resolve_admin_area_column(list(gdf.columns))
+
+    if area_column is not None and area_column in gdf.columns:
+        gdf[area_column] = gdf[area_column].astype("category")
+        area_columns.insert(0, area_column)
+    elif areas_gdf is not None and area_column is not None:
+        gdf[area_column] = assign_admin_areas(gdf, areas_gdf, area_column)
+        area_columns.insert(0, area_column)
+    else:
+        logger.warning("No admin area attribute or area polygons found, only grid cell statistics are computed")
+
+    export_area_statistics(compute_area_statistics(gdf, area_columns), output_path)
+    return gdf
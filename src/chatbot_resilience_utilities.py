@@ -0,0 +1,225 @@
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+# Structured generation statuses, stored alongside the generated values instead of sentinel strings
+GENERATION_STATUS_SUCCESS = "success"
+GENERATION_STATUS_TIMEOUT = "timeout"
+GENERATION_STATUS_RETRIES_EXHAUSTED = "retries_exhausted"
+GENERATION_STATUS_FATAL_ERROR = "fatal_error"
+
+# Exception class names raised by chatbot backends (e.g. hugchat, requests) that are worth retrying
+RETRYABLE_ERROR_NAMES = {
+    "ChatError",
+    "ModelOverloadedError",
+    "ConnectionError",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "Timeout",
+    "ChunkedEncodingError",
+}
+RETRYABLE_ERROR_MESSAGES = ("overloaded", "rate limit", "too many requests")
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# A status code standing on its own in an error message, not part of a number or an id such as '1500' or 'req-503'
+STATUS_CODE_PATTERN = re.compile(r"(?<![\w.-])(\d{3})(?![\w.-])")
+
+
+class RequestTimeoutError(TimeoutError):
+    pass
+
+
+class RetriesExhaustedError(Exception):
+    def __init__(self, message: str, last_exception: Exception):
+        super().__init__(message)
+        self.last_exception = last_exception
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    Classifies an exception raised by a chatbot call as retryable or fatal.
+
+    Timeouts, connection problems and overload/rate limit responses are retryable.
+    Everything else, e.g. authentication or invalid input errors, is treated as fatal.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+
+    if any(error_class.__name__ in RETRYABLE_ERROR_NAMES for error_class in type(error).__mro__):
+        return True
+
+    # Prefer the HTTP status of the response when the exception carries one, e.g. requests.HTTPError
+    status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status_code, int):
+        return status_code in RETRYABLE_STATUS_CODES
+
+    message = str(error).lower()
+    if any(int(code) in RETRYABLE_STATUS_CODES for code in STATUS_CODE_PATTERN.findall(message)):
+        return True
+    return any(retryable_message in message for retryable_message in RETRYABLE_ERROR_MESSAGES)
+
+
+def generation_status_from_error(error: Exception) -> str:
+    if isinstance(error, RetriesExhaustedError):
+        if isinstance(error.last_exception, TimeoutError):
+            return GENERATION_STATUS_TIMEOUT
+        return GENERATION_STATUS_RETRIES_EXHAUSTED
+    if isinstance(error, TimeoutError):
+        return GENERATION_STATUS_TIMEOUT
+    return GENERATION_STATUS_FATAL_ERROR
+
+
+def run_with_deadline(func: Callable[..., Any], timeout_seconds: float, *args: Any, **kwargs: Any) -> Any:
+    """
+    Runs a function in a daemon thread and waits at most timeout_seconds for it to finish.
+
+    A call that is still hanging after the deadline is abandoned, so it cannot stall the run.
+    The abandoned thread keeps running until the call returns, see the on_timeout parameter of call_with_retries.
+
+    Raises:
+        RequestTimeoutError: If the function did not finish before the deadline.
+    """
+    outcome: List[Any] = []
+
+    def target() -> None:
+        try:
+            outcome.append((True, func(*args, **kwargs)))
+        except BaseException as e:
+            outcome.append((False, e))
+
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    worker.join(timeout_seconds)
+
+    if not outcome:
+        raise RequestTimeoutError(f"{func.__name__} did not finish within {timeout_seconds} seconds")
+
+    succeeded, value = outcome[0]
+    if not succeeded:
+        raise value
+    return value
+
+
+def compute_backoff_delay(attempt: int, base_delay_seconds: float, max_delay_seconds: float) -> float:
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(max_delay_seconds, base_delay_seconds * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Pauses all chatbot calls once the backend looks degraded.
+
+    After failure_threshold consecutive retryable failures the breaker opens, and every
+    caller waits until cooldown_seconds have passed. The next call is then let through as
+    a probe: a success closes the breaker, a failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown_seconds: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def wait_until_closed(self) -> None:
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.cooldown_seconds - time.monotonic()
+
+        if remaining > 0:
+            logger.warning(f"Circuit breaker is open. Pausing chatbot calls for {remaining:.1f} seconds...")
+            time.sleep(remaining)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Chatbot backend recovered. Closing circuit breaker.")
+            self.consecutive_failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(
+                        f"{self.consecutive_failures} consecutive chatbot failures. Opening circuit breaker."
+                    )
+                self.opened_at = time.monotonic()
+
+
+def call_with_retries(
+    func: Callable[..., Any],
+    *args: Any,
+    timeout_seconds: float = 120.0,
+    max_retries: int = 3,
+    base_delay_seconds: float = 2.0,
+    max_delay_seconds: float = 60.0,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+    on_timeout: Optional[Callable[[], None]] = None,
+    **kwargs: Any,
+) -> Any:
+    """
+    Calls a function with a per-attempt deadline, retrying retryable errors with exponential backoff.
+
+    Parameters:
+        func (Callable[..., Any]): The function to call.
+        timeout_seconds (float): The deadline for a single attempt. Default is 120 seconds.
+        max_retries (int): The number of retries after the first attempt. Default is 3.
+        base_delay_seconds (float): The base delay of the exponential backoff. Default is 2 seconds.
+        max_delay_seconds (float): The upper bound of a single backoff delay. Default is 60 seconds.
+        circuit_breaker (Optional[CircuitBreaker]): Breaker shared by all callers of the backend. Default is None.
+        on_timeout (Optional[Callable[[], None]]): Called after an attempt timed out, before the retry. The timed out
+            attempt keeps running in its abandoned thread, so this should move the retry off the state that attempt
+            is still using, e.g. by starting a new conversation. Default is None.
+
+    Returns:
+        Any: The return value of func.
+
+    Raises:
+        RetriesExhaustedError: If every attempt failed with a retryable error.
+        Exception: The original exception if it is classified as fatal.
+    """
+    for attempt in range(max_retries + 1):
+        if circuit_breaker is not None:
+            circuit_breaker.wait_until_closed()
+
+        try:
+            result = run_with_deadline(func, timeout_seconds, *args, **kwargs)
+        except Exception as e:
+            if not is_retryable_error(e):
+                logger.error(f"Fatal error calling {func.__name__}: {e}")
+                raise
+
+            if circuit_breaker is not None:
+                circuit_breaker.record_failure()
+
+            if attempt == max_retries:
+                raise RetriesExhaustedError(
+                    f"{func.__name__} failed after {max_retries + 1} attempts: {e}", last_exception=e
+                ) from e
+
+            if on_timeout is not None and isinstance(e, RequestTimeoutError):
+                on_timeout()
+
+            delay = compute_backoff_delay(attempt, base_delay_seconds, max_delay_seconds)
+            logger.warning(
+                f"Retryable error calling {func.__name__} (attempt {attempt + 1}/{max_retries + 1}): {e}. "
+                f"Retrying in {delay:.1f} seconds..."
+            )
+            time.sleep(delay)
+            continue
+
+        if circuit_breaker is not None:
+            circuit_breaker.record_success()
+        return result
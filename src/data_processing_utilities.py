@@ -1,16 +1,22 @@
 import os
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
-import chardet
 import numpy as np
 import pandas as pd
+from tqdm import tqdm
 
 from code_utilities import timing_decorator
 from logging_utils import get_logger
 
 logger = get_logger(__name__)
 
+# Low cardinality label columns, carried through the pipeline as dictionary encoded categoricals
+CATEGORICAL_COLUMNS = ["anlaegsbetydning", "en_anlaegsbetydning", "datering", "fa-icon"]
+
+# The ESRI Shapefile driver truncates attribute names, e.g. 'anlaegsbetydning' is stored as 'anlaegsbet'
+SHAPEFILE_FIELD_NAME_LENGTH = 10
+
 def round_to_decimal(number: float, decimal_places: int = 2) -> float:
     return round(number, decimal_places)
 
@@ -42,6 +48,7 @@ def load_csv_as_df(
 
     if csv_encoding is None:
         logger.info("Attempting to detect file encoding...")
+        import chardet
 
         # Attempt to detect the file encoding with chardet library
         with open(file_path, "rb") as f:
@@ -116,4 +123,372 @@ def add_empty_columns_to_df(
             df = df.assign(**{column: np.nan})
             if dtypes and column in dtypes:
                 df[column] = df[column].astype(dtypes[column])
-    return df
\ No newline at end of file
+    return df
+
+def to_shapefile_column_name(column: str) -> str:
+    return column[:SHAPEFILE_FIELD_NAME_LENGTH]
+
+
+def get_patch_file_path(file_path: Path) -> Path:
+    return file_path.with_name(f"{file_path.stem}.patch.csv")
+
+
+class KeyedTable:
+    """
+    A DataFrame with a hash index from key to row position, for merging new results into it by key.
+
+    The index is built once and kept up to date across upserts, so an upsert only touches the rows
+    of its batch. Appending new keys still copies the table once per upsert that inserts rows.
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        key_column: str,
+        value_columns: List[str],
+        version_column: str = "version",
+        dependent_columns: Optional[List[str]] = None,
+    ):
+        """
+        Parameters:
+            df (pd.DataFrame): The table. Duplicate keys keep their last row.
+            key_column (str): The column identifying a row, e.g. 'anlaegsbetydning'.
+            value_columns (List[str]): The columns upserts write to.
+            version_column (str): The column counting how often a row changed. Default is 'version'.
+            dependent_columns (Optional[List[str]]): Columns derived from the value columns, e.g. a translation.
+                They are cleared in every changed row, so they are derived again. Default is None.
+        """
+        self.key_column = key_column
+        self.value_columns = value_columns
+        self.version_column = version_column
+        self.dependent_columns = [column for column in dependent_columns or [] if column in df.columns]
+
+        df = add_empty_columns_to_df(df, value_columns)
+        if version_column not in df.columns:
+            df[version_column] = np.where(df[value_columns].notna().any(axis=1), 1, 0)
+
+        if df[key_column].duplicated().any():
+            logger.warning(f"Duplicate keys found in column {key_column}. Keeping the last row for each key.")
+            df = df.drop_duplicates(subset=key_column, keep="last")
+
+        # Value columns hold arbitrary values, e.g. lists of sources, so they are object columns from the start
+        self.df = df.astype({column: object for column in value_columns if df[column].dtype != object}).reset_index(drop=True)
+        self.positions: Dict[Any, int] = {key: position for position, key in enumerate(self.df[key_column])}
+
+    def upsert(self, updates_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Merges new results into the table by key.
+
+        Only rows whose values actually changed are updated, and their version is incremented.
+        Keys not in the table are appended with version 1, with every column of updates_df the table has.
+
+        Parameters:
+            updates_df (pd.DataFrame): The new results. Duplicate keys keep their last row.
+
+        Returns:
+            Tuple[pd.DataFrame, pd.DataFrame]: The updated rows and the inserted rows.
+        """
+        updates_df = updates_df.drop_duplicates(subset=self.key_column, keep="last").reset_index(drop=True)
+
+        # Look up the position of every updated key, -1 for new keys
+        positions = np.fromiter(
+            (self.positions.get(key, -1) for key in updates_df[self.key_column]), dtype=np.int64, count=len(updates_df)
+        )
+        is_existing = positions >= 0
+
+        existing_updates = updates_df.loc[is_existing, self.value_columns].reset_index(drop=True)
+        existing_positions = positions[is_existing]
+        current_values = self.df.iloc[existing_positions][self.value_columns].reset_index(drop=True)
+
+        # Compare as strings, so list values compare by content, and treat None and NaN as the same missing value
+        differs = (existing_updates.astype(str) != current_values.astype(str)) & ~(existing_updates.isna() & current_values.isna())
+        changed_mask = differs.any(axis=1).to_numpy()
+        changed_positions = existing_positions[changed_mask]
+
+        for column in self.value_columns:
+            self.df.iloc[changed_positions, self.df.columns.get_loc(column)] = existing_updates.loc[changed_mask, column].to_numpy()
+        for column in self.dependent_columns:
+            self.df.iloc[changed_positions, self.df.columns.get_loc(column)] = np.nan
+        version_index = self.df.columns.get_loc(self.version_column)
+        self.df.iloc[changed_positions, version_index] = self.df.iloc[changed_positions, version_index] + 1
+
+        inserted_rows = self._build_inserted_rows(updates_df.loc[~is_existing])
+        if not inserted_rows.empty:
+            first_position = len(self.df)
+            self.df = pd.concat([self.df, inserted_rows], ignore_index=True)
+            self.positions.update(
+                (key, first_position + offset) for offset, key in enumerate(inserted_rows[self.key_column])
+            )
+
+        updated_rows = self.df.iloc[changed_positions]
+        logger.info(
+            f"Upserted {len(updates_df)} rows by {self.key_column}: {len(updated_rows)} updated, "
+            f"{len(inserted_rows)} inserted, {int(is_existing.sum()) - len(updated_rows)} unchanged"
+        )
+        return updated_rows, inserted_rows
+
+    def _build_inserted_rows(self, new_rows: pd.DataFrame) -> pd.DataFrame:
+        inserted_rows = new_rows.reindex(columns=self.df.columns).reset_index(drop=True)
+        inserted_rows[self.version_column] = 1
+
+        # Use the dtypes of the table where the values allow it, so e.g. integer counts stay integers
+        for column, dtype in self.df.dtypes.items():
+            if inserted_rows[column].dtype == dtype:
+                continue
+            if inserted_rows[column].isna().any() and not isinstance(dtype, pd.CategoricalDtype) and dtype != object:
+                continue
+            try:
+                inserted_rows[column] = inserted_rows[column].astype(dtype)
+            except (TypeError, ValueError):
+                logger.debug(f"Could not cast inserted values of column {column} to {dtype}")
+        return inserted_rows
+
+
+def persist_upserted_rows(
+    merged_df: pd.DataFrame,
+    updated_rows: pd.DataFrame,
+    inserted_rows: pd.DataFrame,
+    file_path: Path,
+    encoding: str = "utf-8",
+) -> None:
+    """
+    Persists the result of an upsert without rewriting the whole CSV file.
+
+    Inserted rows are appended to the CSV file itself. Updated rows are appended to a patch
+    file next to it, which is applied by load_csv_with_patches and folded into the CSV file
+    by compact_csv_patches. The whole file is only rewritten if it does not exist yet or
+    its columns changed.
+    """
+    patch_file_path = get_patch_file_path(file_path)
+
+    existing_columns = (
+        list(pd.read_csv(file_path, nrows=0, encoding=encoding).columns) if file_path.exists() else None
+    )
+    if existing_columns != list(merged_df.columns):
+        logger.info(f"Columns of {file_path} changed or file does not exist. Rewriting the whole file...")
+        export_df_as_csv(merged_df, file_path.parent, file_path.name, encoding=encoding)
+        patch_file_path.unlink(missing_ok=True)
+        return
+
+    if not inserted_rows.empty:
+        logger.info(f"Appending {len(inserted_rows)} new rows to {file_path}")
+        inserted_rows.to_csv(file_path, mode="a", header=False, index=False, encoding=encoding)
+
+    if not updated_rows.empty:
+        logger.info(f"Writing {len(updated_rows)} updated rows to patch file {patch_file_path}")
+        updated_rows.to_csv(
+            patch_file_path, mode="a", header=not patch_file_path.exists(), index=False, encoding=encoding
+        )
+
+
+def load_csv_with_patches(
+    file_path: Path, key_column: str, version_column: str = "version", encoding: str = "utf-8"
+) -> pd.DataFrame:
+    """
+    Loads a CSV file written by persist_upserted_rows and applies its pending patches.
+
+    For every key the row with the highest version wins. The encoding must match the one the
+    rows were persisted with, guessing it misreads short patch files.
+    """
+    df = load_csv_as_df(file_path, csv_encoding=encoding)
+
+    patch_file_path = get_patch_file_path(file_path)
+    if not patch_file_path.exists():
+        return df
+
+    patch_df = load_csv_as_df(patch_file_path, csv_encoding=encoding)
+    logger.info(f"Applying {len(patch_df)} patched rows from {patch_file_path}")
+
+    patch_df = patch_df.sort_values(version_column, kind="stable").drop_duplicates(subset=key_column, keep="last")
+    patch_df = patch_df.reindex(columns=df.columns)
+
+    # Replace rows in place, so the row order of the base file is kept
+    positions = pd.Index(df[key_column]).get_indexer(patch_df[key_column])
+    is_newer = (positions >= 0) & (
+        patch_df[version_column].to_numpy() >= df[version_column].to_numpy()[positions]
+    )
+    df = df.astype({column: object for column in df.columns if df[column].dtype != patch_df[column].dtype})
+    df.iloc[positions[is_newer]] = patch_df.loc[is_newer].to_numpy()
+
+    return df
+
+
+def compact_csv_patches(
+    file_path: Path,
+    key_column: str,
+    version_column: str = "version",
+    min_patch_ratio: float = 0.0,
+    encoding: str = "utf-8",
+) -> None:
+    """
+    Folds the patch file into the CSV file, once the patch file holds at least min_patch_ratio
+    rows relative to the CSV file. The patch file is deleted afterwards.
+    """
+    patch_file_path = get_patch_file_path(file_path)
+    if not patch_file_path.exists():
+        return
+
+    df = load_csv_with_patches(file_path, key_column, version_column, encoding=encoding)
+    patch_row_count = len(pd.read_csv(patch_file_path, usecols=[key_column], encoding=encoding))
+    if patch_row_count < min_patch_ratio * len(df):
+        logger.info(f"Patch file {patch_file_path} holds {patch_row_count} rows. Skipping compaction.")
+        return
+
+    export_df_as_csv(df, file_path.parent, file_path.name, encoding=encoding)
+    patch_file_path.unlink()
+    logger.info(f"Compacted {patch_row_count} patched rows into {file_path}")
+
+
+def encode_categorical_columns(
+    df: pd.DataFrame,
+    columns: Optional[List[str]] = None,
+    vocabularies: Optional[Dict[str, pd.CategoricalDtype]] = None,
+) -> pd.DataFrame:
+    """
+    Dictionary encodes label columns, so each row only holds an integer code into a shared vocabulary.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame to encode.
+        columns (Optional[List[str]]): The columns to encode. Defaults to the CATEGORICAL_COLUMNS present in df,
+            under their full or their truncated shapefile name.
+        vocabularies (Optional[Dict[str, pd.CategoricalDtype]]): Shared vocabularies by full column name, e.g. the
+            dtypes of the CSV columns, so codes are comparable between DataFrames. Defaults to the values in df.
+
+    Returns:
+        pd.DataFrame: The DataFrame with the columns encoded as categoricals.
+    """
+    # Shapefile layers use the truncated names, the vocabularies are keyed by the full CSV names
+    full_column_names = {to_shapefile_column_name(column): column for column in CATEGORICAL_COLUMNS}
+    full_column_names.update({column: column for column in CATEGORICAL_COLUMNS})
+
+    if columns is None:
+        columns = [column for column in df.columns if column in full_column_names]
+    vocabularies = vocabularies or {}
+
+    for column in columns:
+        vocabulary = vocabularies.get(full_column_names.get(column, column))
+        if vocabulary is not None:
+            # Append labels missing from the shared vocabulary, so existing codes keep their meaning
+            categories = vocabulary.categories
+            new_labels = pd.Index(df[column].dropna().unique()).difference(categories)
+            df[column] = df[column].astype(pd.CategoricalDtype(categories=categories.append(new_labels)))
+        else:
+            df[column] = df[column].astype("category")
+
+    logger.debug(f"Encoded columns {columns} as categoricals")
+    return df
+
+
+def decode_categorical_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Decodes all categorical columns back to plain labels, for writers that do not support categoricals.
+    """
+    categorical_columns = [
+        column for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)
+    ]
+    return df.astype({column: object for column in categorical_columns})
+
+
+def map_categorical_values(
+    series: pd.Series, func: Callable[[str], str], progress_description: Optional[str] = None
+) -> pd.Series:
+    """
+    Applies func once per distinct value instead of once per row, and returns a categorical Series.
+
+    Distinct values mapping to the same result are merged into one category.
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype("category")
+
+    categories = series.cat.categories
+    if progress_description is not None:
+        categories = tqdm(categories, desc=progress_description)
+
+    mapped_categories = pd.Series([func(category) for category in categories], dtype=object)
+
+    # Take the mapped value for each code, codes of -1 (missing values) stay missing
+    codes = series.cat.codes.to_numpy()
+    mapped_values = mapped_categories.reindex(codes).to_numpy()
+
+    return pd.Series(mapped_values, index=series.index, name=series.name).astype("category")
+
+
+def compute_anlaegsbetydning_statistics(df: pd.DataFrame, group_column: str = "anlaegsbetydning") -> pd.DataFrame:
+    """
+    Computes the number of monuments, the most frequent datering and the datering distribution per group.
+
+    Works directly on the category codes when the columns are categoricals, only observed groups are returned.
+
+    Parameters:
+        df (pd.DataFrame): The monuments, with a 'datering' column and the group column.
+        group_column (str): The column to group by. Default is 'anlaegsbetydning'.
+
+    Returns:
+        pd.DataFrame: One row per group with the columns group_column, 'counts', 'most_frequent_datering'
+        and 'datering_distributions'.
+    """
+    # Calculate value counts
+    value_counts = df.loc[:, group_column].value_counts()
+    value_counts = value_counts[value_counts > 0]
+
+    datering_distribution_per_group = df.groupby(group_column, observed=True)[
+        "datering"
+    ].value_counts()
+
+    # Convert the series into a DataFrame, dropping unobserved datering categories
+    datering_distribution_per_group_df = datering_distribution_per_group.reset_index(
+        name="count"
+    )
+    datering_distribution_per_group_df = datering_distribution_per_group_df[
+        datering_distribution_per_group_df["count"] > 0
+    ]
+
+    # Calculate the most common datering for each group from the distribution, keeping every tied mode
+    group_max_count = datering_distribution_per_group_df.groupby(group_column, observed=True)[
+        "count"
+    ].transform("max")
+    modes_df = datering_distribution_per_group_df[
+        datering_distribution_per_group_df["count"] == group_max_count
+    ].astype({"datering": object})
+    most_common_datering = modes_df.groupby(group_column, observed=True)["datering"].agg(
+        pd.Series.mode
+    )
+    most_common_datering_df = most_common_datering.reset_index()
+
+    # Convert 'datering' and 'count' into a dictionary grouped by the group column
+    datering_distribution_dict = (
+        datering_distribution_per_group_df.groupby(group_column, observed=True)[[
+            "datering", "count"
+        ]]
+        .apply(
+            lambda x: (
+                dict(zip(x["datering"], x["count"]))
+                if "datering" in x.columns and "count" in x.columns
+                else {}
+            )
+        )
+        .reset_index(name="datering_distributions")
+    )
+
+    # Create a new DataFrame
+    value_counts_df = value_counts.reset_index()
+
+    # Merge value_counts_df and most_common_datering_df on the group column
+    value_counts_df = value_counts_df.merge(
+        most_common_datering_df, on=group_column, how="left"
+    )
+
+    # Merge value_counts_df and datering_distribution_dict on the group column
+    value_counts_df = value_counts_df.merge(
+        datering_distribution_dict, on=group_column, how="left"
+    )
+
+    # Rename the columns
+    value_counts_df.columns = [
+        group_column,
+        "counts",
+        "most_frequent_datering",
+        "datering_distributions",
+    ]
+
+    return value_counts_df
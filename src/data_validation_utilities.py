@@ -0,0 +1,330 @@
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import geopandas as gpd
+import pandas as pd
+
+from code_utilities import timing_decorator
+from data_processing_utilities import to_shapefile_column_name
+from logging_utils import get_logger
+from shapefile_ingestion_utilities import count_features, split_feature_ranges
+
+logger = get_logger(__name__)
+
+SEVERITY_ERROR = "error"
+SEVERITY_WARNING = "warning"
+
+# Value checks run on a sample of this many rows, schema checks always see the full input
+VALIDATION_SAMPLE_SIZE = 200_000
+
+CSV_REQUIRED_COLUMNS = ["anlaegsbetydning", "datering", "kommunenavn"]
+CSV_EXPECTED_DTYPES = {
+    "systemnr": "numeric",
+    "kommunenr": "numeric",
+    "anlaegsbetydning": "text",
+    "datering": "text",
+    "kommunenavn": "text",
+}
+SHAPEFILE_REQUIRED_COLUMNS = ["datering"]
+SHAPEFILE_CRS = "EPSG:25832"
+
+# Denmark including Bornholm in EPSG:25832, with a margin for monuments on the coast
+DENMARK_BOUNDS_25832 = (400_000.0, 6_000_000.0, 910_000.0, 6_420_000.0)
+
+# UTF-8 text decoded as ISO-8859-1 or cp1252, e.g. 'Ã¦' for 'æ', and undecodable bytes
+MOJIBAKE_PATTERN = re.compile("Ã[\x80-\xbf†˜…]|Â[\x80-\xbf]|�")
+
+
+class DataValidationError(Exception):
+    def __init__(self, report: "ValidationReport"):
+        super().__init__(f"{report.source} failed validation with {report.error_count} errors")
+        self.report = report
+
+
+class ValidationReport:
+    """
+    Collects the failed checks of one input, with the number of failing rows and an example value per check.
+    """
+
+    def __init__(self, source: str, row_count: int, checked_row_count: Optional[int] = None):
+        self.source = source
+        self.row_count = row_count
+        self.checked_row_count = row_count if checked_row_count is None else checked_row_count
+        self.issues: List[Dict[str, Any]] = []
+
+    def add_issue(
+        self,
+        check: str,
+        column: Optional[str],
+        failed_count: int,
+        severity: str = SEVERITY_ERROR,
+        example: Any = None,
+    ) -> None:
+        self.issues.append(
+            {
+                "check": check,
+                "column": column,
+                "severity": severity,
+                "failed": int(failed_count),
+                "checked": self.checked_row_count,
+                "example": None if example is None else str(example),
+            }
+        )
+
+    @property
+    def error_count(self) -> int:
+        return sum(issue["severity"] == SEVERITY_ERROR for issue in self.issues)
+
+    @property
+    def has_errors(self) -> bool:
+        return self.error_count > 0
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.issues, columns=["check", "column", "severity", "failed", "checked", "example"])
+
+    def log(self) -> None:
+        sampled = f", {self.checked_row_count} sampled" if self.checked_row_count < self.row_count else ""
+        logger.info(f"Validation of {self.source}: {self.row_count} rows{sampled}, {len(self.issues)} issues")
+        for issue in self.issues:
+            log = logger.error if issue["severity"] == SEVERITY_ERROR else logger.warning
+            example = f" (e.g. {issue['example']!r})" if issue["example"] is not None else ""
+            log(f"{issue['check']} [{issue['column']}]: {issue['failed']}/{issue['checked']} rows{example}")
+
+    def save(self, output_path: Path) -> None:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {"source": self.source, "row_count": self.row_count, "checked_row_count": self.checked_row_count, "issues": self.issues},
+                file,
+                ensure_ascii=False,
+                indent=2,
+            )
+
+    def raise_for_errors(self) -> None:
+        """
+        Logs the report and raises DataValidationError if any check failed with severity error.
+        """
+        self.log()
+        if self.has_errors:
+            raise DataValidationError(self)
+
+
+def sample_rows(df: pd.DataFrame, max_rows: int = VALIDATION_SAMPLE_SIZE, seed: int = 0) -> pd.DataFrame:
+    if len(df) <= max_rows:
+        return df
+    return df.sample(n=max_rows, random_state=seed)
+
+
+def check_schema(
+    report: ValidationReport,
+    columns: List[str],
+    required_columns: List[str],
+    expected_columns: Optional[List[str]] = None,
+) -> None:
+    """
+    Reports missing required columns as errors and missing expected columns as warnings.
+    """
+    available = set(columns)
+    for column in required_columns:
+        if column not in available:
+            report.add_issue("missing_column", column, report.checked_row_count)
+    for column in expected_columns or []:
+        if column not in available:
+            report.add_issue("missing_column", column, report.checked_row_count, severity=SEVERITY_WARNING)
+
+
+def check_dtypes(report: ValidationReport, df: pd.DataFrame, expected_dtypes: Dict[str, str]) -> None:
+    """
+    Checks that columns hold 'numeric' or 'text' values. Columns missing from df are skipped.
+    """
+    for column, kind in expected_dtypes.items():
+        if column not in df.columns:
+            continue
+        series = df[column]
+        is_numeric = pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+
+        if kind == "numeric" and not is_numeric:
+            # Text columns are fine if every value parses as a number
+            not_parsed = pd.to_numeric(series.astype("string"), errors="coerce").isna() & series.notna()
+            if not_parsed.any():
+                report.add_issue("not_numeric", column, not_parsed.sum(), example=series[not_parsed].iloc[0])
+        elif kind == "text" and is_numeric:
+            report.add_issue("not_text", column, series.notna().sum(), example=series.dtype)
+
+
+def check_missing_values(report: ValidationReport, df: pd.DataFrame, columns: List[str], max_missing_ratio: float = 0.5) -> None:
+    """
+    Reports columns that are entirely missing as errors, and columns above max_missing_ratio as warnings.
+    """
+    missing_counts = df[[column for column in columns if column in df.columns]].isna().sum()
+    for column, missing_count in missing_counts.items():
+        if len(df) > 0 and missing_count == len(df):
+            report.add_issue("all_missing", column, missing_count)
+        elif len(df) > 0 and missing_count / len(df) > max_missing_ratio:
+            report.add_issue("mostly_missing", column, missing_count, severity=SEVERITY_WARNING)
+
+
+def check_encoding(report: ValidationReport, df: pd.DataFrame, columns: Optional[List[str]] = None) -> None:
+    """
+    Reports text that was decoded with the wrong encoding. Categorical columns are checked once per category.
+
+    Parameters:
+        report (ValidationReport): The report to add issues to.
+        df (pd.DataFrame): The data to check.
+        columns (Optional[List[str]]): The columns to check. Defaults to every text and categorical column.
+    """
+    if columns is None:
+        columns = [
+            column
+            for column in df.columns
+            if isinstance(df[column].dtype, pd.CategoricalDtype) or pd.api.types.is_object_dtype(df[column].dtype)
+        ]
+
+    for column in columns:
+        if column not in df.columns or (isinstance(df, gpd.GeoDataFrame) and column == df.geometry.name):
+            continue
+        series = df[column]
+
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            categories = series.cat.categories.astype(str)
+            bad_categories = categories.str.contains(MOJIBAKE_PATTERN)
+            if not bad_categories.any():
+                continue
+            codes = series.cat.codes.to_numpy()
+            bad_rows = (codes >= 0) & bad_categories[codes]
+            example = categories[bad_categories][0]
+        else:
+            bad_rows = series.astype("string").str.contains(MOJIBAKE_PATTERN, na=False).to_numpy()
+            if not bad_rows.any():
+                continue
+            example = series[bad_rows].iloc[0]
+
+        report.add_issue("mojibake", column, bad_rows.sum(), example=example)
+
+
+def check_geometries(report: ValidationReport, gdf: gpd.GeoDataFrame) -> None:
+    geometry = gdf.geometry
+    missing = geometry.isna()
+    empty = ~missing & geometry.is_empty
+    invalid = ~missing & ~empty & ~geometry.is_valid
+
+    if missing.any():
+        report.add_issue("missing_geometry", geometry.name, missing.sum())
+    if empty.any():
+        report.add_issue("empty_geometry", geometry.name, empty.sum(), severity=SEVERITY_WARNING)
+    if invalid.any():
+        # Invalid geometries can usually be repaired with make_valid, they do not stop the pipeline
+        report.add_issue(
+            "invalid_geometry", geometry.name, invalid.sum(), severity=SEVERITY_WARNING, example=geometry[invalid].iloc[0].wkt[:80]
+        )
+
+
+def check_bounding_box(
+    report: ValidationReport,
+    gdf: gpd.GeoDataFrame,
+    expected_crs: str = SHAPEFILE_CRS,
+    bounds: Tuple[float, float, float, float] = DENMARK_BOUNDS_25832,
+) -> None:
+    """
+    Checks the CRS of the layer, and that every geometry lies within the expected bounds.
+    """
+    if gdf.crs is None or not gdf.crs.equals(expected_crs):
+        report.add_issue("unexpected_crs", gdf.geometry.name, len(gdf), example=gdf.crs)
+        # Coordinates in another CRS are not comparable with the bounds
+        return
+
+    min_x, min_y, max_x, max_y = bounds
+    geometry_bounds = gdf.geometry.bounds
+    outside = (
+        (geometry_bounds["minx"] < min_x)
+        | (geometry_bounds["miny"] < min_y)
+        | (geometry_bounds["maxx"] > max_x)
+        | (geometry_bounds["maxy"] > max_y)
+    )
+    if outside.any():
+        example = tuple(geometry_bounds[outside].iloc[0].round(1))
+        report.add_issue("outside_bounds", gdf.geometry.name, outside.sum(), example=example)
+
+
+@timing_decorator(logger=logger)
+def validate_monuments_csv(
+    df: pd.DataFrame,
+    required_columns: List[str] = CSV_REQUIRED_COLUMNS,
+    expected_dtypes: Dict[str, str] = CSV_EXPECTED_DTYPES,
+    max_rows: int = VALIDATION_SAMPLE_SIZE,
+    source: str = "monuments csv",
+) -> ValidationReport:
+    """
+    Validates the schema, dtypes, missing values and encoding of the monuments table, right after loading it.
+    """
+    sample_df = sample_rows(df, max_rows)
+    report = ValidationReport(source, len(df), len(sample_df))
+
+    check_schema(report, list(df.columns), required_columns)
+    check_dtypes(report, sample_df, expected_dtypes)
+    check_missing_values(report, sample_df, required_columns)
+    check_encoding(report, sample_df)
+
+    return report
+
+
+def read_shapefile_sample(
+    input_path: Path, feature_count: int, max_rows: int = VALIDATION_SAMPLE_SIZE, sample_slices: int = 8
+) -> gpd.GeoDataFrame:
+    """
+    Reads at most max_rows features, as sample_slices contiguous ranges spread over the whole layer.
+    """
+    if feature_count <= max_rows:
+        return gpd.read_file(input_path)
+
+    rows_per_slice = max_rows // sample_slices
+    parts = [
+        gpd.read_file(input_path, rows=slice(feature_range.start, feature_range.start + rows_per_slice))
+        for feature_range in split_feature_ranges(feature_count, sample_slices)
+    ]
+    return gpd.GeoDataFrame(pd.concat(parts, ignore_index=True), crs=parts[0].crs)
+
+
+@timing_decorator(logger=logger)
+def validate_monuments_shapefile(
+    input_path: Path,
+    required_columns: List[str] = SHAPEFILE_REQUIRED_COLUMNS,
+    columns_to_remove: Optional[List[str]] = None,
+    expected_crs: str = SHAPEFILE_CRS,
+    bounds: Tuple[float, float, float, float] = DENMARK_BOUNDS_25832,
+    max_rows: int = VALIDATION_SAMPLE_SIZE,
+) -> ValidationReport:
+    """
+    Validates the monuments layer before any stage reads it in full.
+
+    The schema comes from the layer metadata, geometry, bounding box and encoding checks run on a sample.
+
+    Parameters:
+        input_path (Path): The path of the shapefile.
+        required_columns (List[str]): Attributes the later stages need, by full or truncated name.
+        columns_to_remove (Optional[List[str]]): Attributes preprocessing drops, missing ones are reported as warnings.
+            Full names are checked under their truncated shapefile name.
+        expected_crs (str): The CRS of the layer. Default is EPSG:25832.
+        bounds (Tuple[float, float, float, float]): The bounds all geometries must lie within, in the expected CRS.
+        max_rows (int): The largest number of features read for the value checks.
+
+    Returns:
+        ValidationReport: The report of the failed checks.
+    """
+    feature_count, attribute_names = count_features(input_path)
+    sample_gdf = read_shapefile_sample(input_path, feature_count, max_rows)
+    report = ValidationReport(input_path.name, feature_count, len(sample_gdf))
+
+    # Attribute names in the layer are truncated, e.g. 'sevaerdighedsklasse' is stored as 'sevaerdigh'
+    required_columns = [to_shapefile_column_name(column) for column in required_columns]
+    expected_columns = list(dict.fromkeys(to_shapefile_column_name(column) for column in columns_to_remove or []))
+
+    check_schema(report, attribute_names, required_columns, expected_columns=expected_columns)
+    check_missing_values(report, sample_gdf, required_columns)
+    check_geometries(report, sample_gdf)
+    check_bounding_box(report, sample_gdf, expected_crs, bounds)
+    check_encoding(report, sample_gdf)
+
+    return report
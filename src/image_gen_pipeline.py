@@ -1,52 +1,224 @@
-import os
+from __future__ import annotations
+
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional, Tuple
 
-from dotenv import load_dotenv
-from hugchat import hugchat
-from hugchat.login import Login
+import pandas as pd
+from tqdm import tqdm
 
+from chatbot_resilience_utilities import (
+    CircuitBreaker,
+    call_with_retries,
+    generation_status_from_error,
+    GENERATION_STATUS_SUCCESS,
+)
+from data_processing_utilities import load_csv_as_df, load_csv_with_patches
+from llm_cache_utilities import ResponseCache
 from logging_utils import get_logger
+from rag_desc_generation_pipeline import CHATBOT_BACKEND, create_hf_chatbot, start_new_conversation
+
+if TYPE_CHECKING:
+    from hugchat import hugchat
 
 logger = get_logger(__name__)
 
- # Load environment variables from .env file
-env_file_path = Path(__file__).resolve().parents[1] / "data" / "hf_creds.env"
-load_dotenv(dotenv_path=env_file_path)
+DESC_PROMPT = "Generer en fængende beskrivelse af fortidsminde udfra følgelde link. Formuler dig som om du er en ekspert inden for dansk kulturhistorie. Du bør altid inddrage fortidsmindets anlæg og datering. LINK: "
+TEXT_DESC_PROMPT = "Generer en fængende beskrivelse af fortidsminde udfra følgende tekst. Formuler dig som om du er en ekspert inden for dansk kulturhistorie. TEKST: "
+REWRITE_PROMPT = "Omskriv følgende tekst til en billedgenererings prompt. Behold kun det mest essentielle information, der beskriver visuelle elementer. TEKST:"
 
-# Get environment variables for HF sign in
-EMAIL = os.getenv("EMAIL")
-PASSWD = os.getenv("PASSWORD")
+REQUEST_TIMEOUT_SECONDS = 180
+MAX_RETRIES = 3
 
-cookie_path_dir = (
-    "./cookies/"  # Note: trailing slash (/) is required to avoid errors
-)
-sign = Login(EMAIL, PASSWD)
-cookies = sign.login(cookie_dir_path=cookie_path_dir, save_cookies=True)
+SOURCE_HASH_COLUMN = "source_hash"
+RESULT_COLUMNS = [SOURCE_HASH_COLUMN, "description", "image_prompt", "generation_status"]
 
-# Create a chatbot instance
-chatbot = hugchat.ChatBot(
-    cookies=cookies.get_dict()
-)  # or cookie_path="usercookies/<email>.json"
 
-logger.info(
-    f"Created chatbot instance using the following model: {chatbot.active_model}"
-)
+def prompt_chatbot_for_text(
+    chatbot: hugchat.ChatBot,
+    prompt: str,
+    response_cache: Optional[ResponseCache] = None,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+) -> str:
+    model = getattr(chatbot, "active_model", None)
+    if response_cache is not None:
+        cached_text = response_cache.get(CHATBOT_BACKEND, model, prompt)
+        if cached_text is not None:
+            return cached_text
+
+    def send_and_wait() -> str:
+        message = chatbot.chat(prompt, web_search=False)
+        logger.debug("Message sent to chatbot.")
+        message.wait_until_done()
+        return message.get_final_text()
+
+    text = call_with_retries(
+        send_and_wait,
+        timeout_seconds=REQUEST_TIMEOUT_SECONDS,
+        max_retries=MAX_RETRIES,
+        circuit_breaker=circuit_breaker,
+        on_timeout=lambda: start_new_conversation(chatbot),
+    )
+
+    if response_cache is not None:
+        response_cache.set(CHATBOT_BACKEND, model, prompt, text)
+    return text
+
+
+def generate_image_prompt(
+    chatbot: hugchat.ChatBot,
+    source: str,
+    source_is_url: bool = False,
+    response_cache: Optional[ResponseCache] = None,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+) -> Tuple[str, str]:
+    """
+    Generates a monument description from a link or a text, and rewrites it into an image generation prompt.
+
+    Returns:
+        Tuple[str, str]: The description and the image prompt.
+    """
+    description_prompt = (DESC_PROMPT if source_is_url else TEXT_DESC_PROMPT) + source
+    monument_description = prompt_chatbot_for_text(chatbot, description_prompt, response_cache, circuit_breaker)
+    image_prompt = prompt_chatbot_for_text(
+        chatbot, REWRITE_PROMPT + monument_description, response_cache, circuit_breaker
+    )
+    return monument_description, image_prompt
+
+
+def hash_source(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def load_image_prompt_results(results_path: Path, key_column: str) -> pd.DataFrame:
+    if not results_path.exists():
+        return pd.DataFrame(columns=[key_column] + RESULT_COLUMNS)
+
+    # Later rows of a key are retries of earlier ones, the last attempt wins
+    results_df = load_csv_as_df(results_path, csv_encoding="utf-8")
+    # Results written before the source hash was stored count as generated from an unknown source
+    results_df = results_df.reindex(columns=[key_column] + RESULT_COLUMNS)
+    return results_df.drop_duplicates(subset=key_column, keep="last")
+
+
+def generate_image_prompts_from_dataframe(
+    df: pd.DataFrame,
+    key_column: str,
+    source_column: str,
+    chatbot_factory: Callable[[], hugchat.ChatBot],
+    results_path: Path,
+    source_is_url: bool = False,
+    max_concurrency: int = 4,
+    response_cache: Optional[ResponseCache] = None,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+) -> pd.DataFrame:
+    """
+    Generates image prompts for many monuments or categories, with bounded concurrency.
+
+    Rows with the same source are generated once. Every finished item is appended to the results
+    CSV straight away with a hash of its source, and items that already succeeded in an earlier run
+    from the same source are skipped, so a stopped run resumes where it left off while items whose
+    source changed are generated again.
+
+    Parameters:
+        df (pd.DataFrame): The monuments or categories.
+        key_column (str): The column identifying an item, e.g. 'anlaegsbetydning'.
+        source_column (str): The column to describe, a link or a text such as 'definition'.
+        chatbot_factory (Callable[[], hugchat.ChatBot]): Creates a chatbot. Every worker thread gets its own chatbot.
+        results_path (Path): The CSV file results are appended to.
+        source_is_url (bool): Whether the source column holds links. Default is False.
+        max_concurrency (int): The largest number of items generated at the same time. Default is 4.
+        response_cache (Optional[ResponseCache]): Cache of chatbot responses, keyed by the prompt. Default is None.
+        circuit_breaker (Optional[CircuitBreaker]): Breaker shared by all workers. Defaults to a new breaker.
+
+    Returns:
+        pd.DataFrame: The latest result of every item.
+    """
+    if circuit_breaker is None:
+        circuit_breaker = CircuitBreaker()
+
+    existing_results = load_image_prompt_results(results_path, key_column)
+    if results_path.exists() and SOURCE_HASH_COLUMN not in pd.read_csv(results_path, nrows=0, encoding="utf-8").columns:
+        # Results of an earlier version have no source hash column, rewrite them so new rows line up with the header
+        existing_results.to_csv(results_path, index=False, encoding="utf-8")
+
+    succeeded_results = existing_results[existing_results["generation_status"] == GENERATION_STATUS_SUCCESS]
+    completed = set(zip(succeeded_results[key_column], succeeded_results[SOURCE_HASH_COLUMN]))
+
+    items_df = df.loc[df[source_column].notna(), [key_column, source_column]]
+    source_hashes = items_df[source_column].astype(str).map(hash_source)
+    is_completed = pd.MultiIndex.from_arrays([items_df[key_column], source_hashes]).isin(list(completed))
+    pending_df = items_df[~is_completed]
+    completed_keys = set(items_df.loc[is_completed, key_column])
+    keys_per_source = pending_df.groupby(source_column, sort=False)[key_column].apply(list)
+    logger.info(
+        f"Generating image prompts for {len(pending_df)} items ({len(keys_per_source)} distinct sources), "
+        f"{len(completed_keys)} already completed"
+    )
+
+    # One chatbot per worker thread, chatbot conversations are not shared between threads
+    thread_state = threading.local()
+
+    def generate_for_source(source: str) -> Tuple[str, str, str]:
+        if not hasattr(thread_state, "chatbot"):
+            thread_state.chatbot = chatbot_factory()
+        try:
+            description, image_prompt = generate_image_prompt(
+                thread_state.chatbot, source, source_is_url, response_cache, circuit_breaker
+            )
+            return description, image_prompt, GENERATION_STATUS_SUCCESS
+        except Exception as e:
+            logger.error(f"Could not generate image prompt from {source[:80]}: {e}")
+            return None, None, generation_status_from_error(e)
+
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {executor.submit(generate_for_source, source): source for source in keys_per_source.index}
+
+        # Results are appended from this thread only, as they complete
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Generating image prompts"):
+            description, image_prompt, status = future.result()
+            keys = keys_per_source[futures[future]]
+            result_rows = pd.DataFrame(
+                {
+                    key_column: keys,
+                    SOURCE_HASH_COLUMN: hash_source(str(futures[future])),
+                    "description": description,
+                    "image_prompt": image_prompt,
+                    "generation_status": status,
+                }
+            )
+            result_rows.to_csv(
+                results_path, mode="a", header=not results_path.exists(), index=False, encoding="utf-8"
+            )
+
+    if response_cache is not None:
+        response_cache.log_stats()
+
+    return load_image_prompt_results(results_path, key_column)
 
-desc_prompt = "Generer en fængende beskrivelse af fortidsminde udfra følgelde link. Formuler dig som om du er en ekspert inden for dansk kulturhistorie. Du bør altid inddrage fortidsmindets anlæg og datering. LINK: https://www.kulturarv.dk/fundogfortidsminder/Lokalitet/38484/Udskriv/"
-rewrite_prompt = "Omskriv følgende tekst til en billedgenererings prompt. Behold kun det mest essentielle information, der beskriver visuelle elementer. TEKST:"
 
-desc_message = chatbot.chat(desc_prompt, web_search=False)
-logger.debug("Message sent to chatbot.")
-desc_message.wait_until_done()
+def main():
+    env_file_path = Path(__file__).resolve().parents[1] / "data" / "hf_creds.env"
+    output_path = Path(__file__).resolve().parents[1] / "data" / "output"
 
-monument_description = desc_message.get_final_text()
+    # Definitions regenerated since the last compaction are only in the patch file
+    df = load_csv_with_patches(output_path / "anlaegsbetydning_with_definitions.csv", key_column="anlaegsbetydning")
 
-rewrite_message = chatbot.chat(rewrite_prompt + monument_description, web_search=False)
-logger.debug("Message sent to chatbot.")
-rewrite_message.wait_until_done()
+    results_df = generate_image_prompts_from_dataframe(
+        df,
+        key_column="anlaegsbetydning",
+        source_column="definition",
+        chatbot_factory=lambda: create_hf_chatbot(env_file_path),
+        results_path=output_path / "image_prompts.csv",
+        response_cache=ResponseCache(output_path / "image_prompt_cache.jsonl"),
+    )
 
-rewritten_description = rewrite_message.get_final_text()
+    logger.info(f"Image prompts available for {(results_df['generation_status'] == GENERATION_STATUS_SUCCESS).sum()} items")
+    logger.info("Script completed!")
 
-print(rewritten_description)
 
-print("Script completed")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+# Parenthesised qualifiers that carry no information, e.g. 'Brandgrav (uspecificeret type)'.
+# Other qualifiers such as '(langhøj)' or '(middelalder)' distinguish categories and are kept
+UNINFORMATIVE_QUALIFIERS = ["uspecificeret type", "uspecificeret", "ukendt", "ukendt type", "andet", "øvrige"]
+UNINFORMATIVE_QUALIFIER_PATTERN = re.compile(
+    r"\(\s*(?:" + "|".join(re.escape(qualifier) for qualifier in UNINFORMATIVE_QUALIFIERS) + r")\s*\)",
+    re.IGNORECASE,
+)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def hash_prompt(backend: str, model: str, prompt: str) -> str:
+    """
+    Creates a stable cache key from the backend, model and prompt.
+
+    Parameters:
+        backend (str): The name of the chatbot backend, e.g. 'hugchat'.
+        model (str): The name of the model answering the prompt.
+        prompt (str): The full prompt sent to the model.
+
+    Returns:
+        str: The hex digest identifying the request.
+    """
+    key_material = "\x1f".join([backend, str(model), prompt])
+    return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+
+def normalise_category_label(label: str) -> str:
+    """
+    Normalises a category label so near-identical labels compare equal,
+    e.g. 'Brandgrav (uspecificeret type)' and 'Brandgrav' both become 'brandgrav'.
+
+    Only the qualifiers in UNINFORMATIVE_QUALIFIERS are removed, so 'Høj (langhøj)' and
+    'Høj (rundhøj)' stay different labels.
+    """
+    label = UNINFORMATIVE_QUALIFIER_PATTERN.sub(" ", str(label))
+    label = WHITESPACE_PATTERN.sub(" ", label)
+    return label.strip(" ,.;:-").lower()
+
+
+def group_near_identical_labels(labels: Iterable[str]) -> Dict[str, str]:
+    """
+    Groups labels by their normalised form and picks one representative per group.
+
+    The shortest label in a group is used as representative, as it is usually the
+    one without qualifiers.
+
+    Parameters:
+        labels (Iterable[str]): The category labels to group.
+
+    Returns:
+        Dict[str, str]: A mapping from every label to the representative label of its group.
+    """
+    representatives: Dict[str, str] = {}
+    for label in labels:
+        if not isinstance(label, str):
+            continue
+        key = normalise_category_label(label)
+        current = representatives.get(key)
+        if current is None or len(label) < len(current):
+            representatives[key] = label
+
+    return {
+        label: representatives[normalise_category_label(label)]
+        for label in labels
+        if isinstance(label, str)
+    }
+
+
+class ResponseCache:
+    """
+    Persistent cache of chatbot responses keyed by (backend, model, prompt hash).
+
+    Entries are kept in memory and appended to a JSON lines file, so a cache
+    survives between runs and a crashed run never loses earlier entries.
+    """
+
+    def __init__(self, cache_path: Optional[Path] = None):
+        self.cache_path = cache_path
+        self.entries: Dict[str, Any] = {}
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "grouped_labels": 0}
+        self._lock = threading.Lock()
+
+        if self.cache_path is not None:
+            self.load()
+
+    def load(self) -> None:
+        if not self.cache_path.exists():
+            logger.info(f"No response cache found at {self.cache_path}. Starting with an empty cache.")
+            return
+
+        with open(self.cache_path, "r", encoding="utf-8") as file:
+            for line_number, line in enumerate(file, start=1):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping corrupt cache line {line_number} in {self.cache_path}")
+                    continue
+                self.entries[record["key"]] = record["value"]
+
+        logger.info(f"Loaded {len(self.entries)} cached responses from {self.cache_path}")
+
+    def get(self, backend: str, model: str, prompt: str) -> Optional[Any]:
+        key = hash_prompt(backend, model, prompt)
+        with self._lock:
+            if key in self.entries:
+                self.stats["hits"] += 1
+                return self.entries[key]
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, backend: str, model: str, prompt: str, value: Any) -> None:
+        key = hash_prompt(backend, model, prompt)
+        with self._lock:
+            self.entries[key] = value
+            self.stats["writes"] += 1
+
+            if self.cache_path is not None:
+                self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.cache_path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps({"key": key, "value": value}, ensure_ascii=False) + "\n")
+
+    def record_grouped_labels(self, count: int) -> None:
+        with self._lock:
+            self.stats["grouped_labels"] += count
+
+    def log_stats(self) -> None:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0.0
+        logger.info(
+            f"Response cache stats: {self.stats['hits']} hits, {self.stats['misses']} misses "
+            f"({hit_rate:.1%} hit rate), {self.stats['writes']} writes, "
+            f"{self.stats['grouped_labels']} labels folded into a near-identical label"
+        )
@@ -0,0 +1,232 @@
+import json
+import struct
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from code_utilities import timing_decorator
+from logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+# File layout: magic, format version, header length, JSON header, then every array aligned to ARRAY_ALIGNMENT bytes
+STORE_MAGIC = b"MONSTORE"
+STORE_VERSION = 1
+PREAMBLE_FORMAT = "<8sIQ"
+ARRAY_ALIGNMENT = 64
+
+
+def _pad_to_alignment(position: int) -> int:
+    return -position % ARRAY_ALIGNMENT
+
+
+@timing_decorator(logger=logger)
+def write_monument_store(gdf: gpd.GeoDataFrame, output_path: Path, id_column: Optional[str] = None) -> None:
+    """
+    Writes the monuments to a single file that readers memory-map, instead of loading their own copy.
+
+    Coordinates and numeric columns are stored as fixed-width arrays, categorical columns as integer
+    codes with row postings per category, and all other columns as offsets into a UTF-8 string heap.
+
+    Parameters:
+        gdf (gpd.GeoDataFrame): The monuments. Categorical columns are stored as codes, see encode_categorical_columns.
+        output_path (Path): The path of the store file.
+        id_column (Optional[str]): An integer column identifying a monument. Defaults to the row position.
+    """
+    row_count = len(gdf)
+    arrays: Dict[str, np.ndarray] = {}
+    columns: Dict[str, Dict[str, Any]] = {}
+
+    # Representative points lie on the geometry, also for lines and polygons
+    points = gdf.geometry.representative_point()
+    arrays["x"] = points.x.to_numpy(dtype=np.float64)
+    arrays["y"] = points.y.to_numpy(dtype=np.float64)
+
+    ids = gdf[id_column].to_numpy(dtype=np.int64) if id_column else np.arange(row_count, dtype=np.int64)
+    arrays["ids"] = ids
+    # Ids sorted with their row positions, for binary search lookups by id
+    id_order = np.argsort(ids, kind="stable")
+    arrays["ids_sorted"] = ids[id_order]
+    arrays["ids_sorted_rows"] = id_order.astype(np.int64)
+
+    for column in gdf.columns:
+        if column in (gdf.geometry.name, id_column):
+            continue
+        series = gdf[column]
+
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy().astype(np.int32)
+            arrays[f"{column}/codes"] = codes
+
+            # Rows of every category, in CSR format, so category lookups are a slice
+            observed = codes >= 0
+            arrays[f"{column}/postings"] = np.flatnonzero(observed)[
+                np.argsort(codes[observed], kind="stable")
+            ].astype(np.int64)
+            arrays[f"{column}/indptr"] = np.concatenate(
+                [[0], np.cumsum(np.bincount(codes[observed], minlength=len(series.cat.categories)))]
+            ).astype(np.int64)
+
+            columns[column] = {"kind": "category", "categories": [str(label) for label in series.cat.categories]}
+        elif pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+            arrays[f"{column}/values"] = series.to_numpy(dtype=np.float64 if series.isna().any() else None)
+            columns[column] = {"kind": "numeric"}
+        else:
+            is_null = series.isna().to_numpy()
+            encoded = [b"" if null else str(value).encode("utf-8") for value, null in zip(series, is_null)]
+            arrays[f"{column}/offsets"] = np.concatenate(
+                [[0], np.cumsum([len(value) for value in encoded])]
+            ).astype(np.int64)
+            arrays[f"{column}/heap"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+            arrays[f"{column}/is_null"] = is_null.astype(np.uint8)
+            columns[column] = {"kind": "string"}
+
+    # Lay out the arrays after the header, each aligned for zero-copy views
+    array_specs = {}
+    position = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        array_specs[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": position}
+        position += array.nbytes + _pad_to_alignment(array.nbytes)
+
+    header = {
+        "row_count": row_count,
+        "crs": gdf.crs.to_string() if gdf.crs is not None else None,
+        "columns": columns,
+        "arrays": array_specs,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = struct.calcsize(PREAMBLE_FORMAT) + len(header_bytes)
+    data_start += _pad_to_alignment(data_start)
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "wb") as file:
+        file.write(struct.pack(PREAMBLE_FORMAT, STORE_MAGIC, STORE_VERSION, len(header_bytes)))
+        file.write(header_bytes)
+        file.write(b"\0" * (data_start - file.tell()))
+        for name, array in arrays.items():
+            file.write(array.tobytes())
+            file.write(b"\0" * _pad_to_alignment(array.nbytes))
+
+    logger.info(f"Wrote monument store with {row_count} rows and {len(columns)} columns to {output_path}")
+
+
+class MonumentStore:
+    """
+    Read API over a store file written by write_monument_store.
+
+    The file is memory-mapped read-only and every array is a zero-copy NumPy view into it, so any
+    number of worker processes share one copy of the data in the page cache.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._buffer = np.memmap(path, dtype=np.uint8, mode="r")
+
+        preamble_size = struct.calcsize(PREAMBLE_FORMAT)
+        magic, version, header_length = struct.unpack(PREAMBLE_FORMAT, self._buffer[:preamble_size].tobytes())
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError(f"{path} is not a monument store of version {STORE_VERSION}")
+
+        header = json.loads(self._buffer[preamble_size:preamble_size + header_length].tobytes())
+        self.row_count: int = header["row_count"]
+        self.crs: Optional[str] = header["crs"]
+        self.columns: Dict[str, Dict[str, Any]] = header["columns"]
+        self._array_specs = header["arrays"]
+        self._category_codes = {
+            column: {label: code for code, label in enumerate(spec["categories"])}
+            for column, spec in self.columns.items()
+            if spec["kind"] == "category"
+        }
+
+        data_start = preamble_size + header_length
+        self._data_start = data_start + _pad_to_alignment(data_start)
+
+    def array(self, name: str) -> np.ndarray:
+        spec = self._array_specs[name]
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"]))
+        return np.frombuffer(
+            self._buffer, dtype=dtype, count=count, offset=self._data_start + spec["offset"]
+        ).reshape(spec["shape"])
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.array("x")
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.array("y")
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self.array("ids")
+
+    def codes(self, column: str) -> np.ndarray:
+        return self.array(f"{column}/codes")
+
+    def categories(self, column: str) -> List[str]:
+        return self.columns[column]["categories"]
+
+    def rows_by_id(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Returns the row positions of the given ids, -1 for unknown ids.
+        """
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        sorted_ids = self.array("ids_sorted")
+        if len(sorted_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        rows = self.array("ids_sorted_rows")[positions]
+        return np.where(sorted_ids[positions] == ids, rows, -1)
+
+    def rows_by_category(self, column: str, label: str) -> np.ndarray:
+        """
+        Returns the row positions of a category as a zero-copy view.
+        """
+        code = self._category_codes[column].get(label)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        indptr = self.array(f"{column}/indptr")
+        return self.array(f"{column}/postings")[indptr[code]:indptr[code + 1]]
+
+    def value(self, column: str, row: int) -> Any:
+        kind = self.columns[column]["kind"]
+        if kind == "category":
+            code = self.codes(column)[row]
+            return self.categories(column)[code] if code >= 0 else None
+        if kind == "numeric":
+            return self.array(f"{column}/values")[row].item()
+        if self.array(f"{column}/is_null")[row]:
+            return None
+        offsets = self.array(f"{column}/offsets")
+        return self.array(f"{column}/heap")[offsets[row]:offsets[row + 1]].tobytes().decode("utf-8")
+
+    def row(self, row: int) -> Dict[str, Any]:
+        record = {"id": int(self.ids[row]), "x": float(self.x[row]), "y": float(self.y[row])}
+        record.update({column: self.value(column, row) for column in self.columns})
+        return record
+
+    def to_dataframe(self, rows: Optional[np.ndarray] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Decodes selected rows and columns into a DataFrame. Categorical columns stay categoricals.
+        """
+        if rows is None:
+            rows = np.arange(self.row_count)
+        if columns is None:
+            columns = list(self.columns)
+
+        data = {"id": self.ids[rows], "x": self.x[rows], "y": self.y[rows]}
+        for column in columns:
+            kind = self.columns[column]["kind"]
+            if kind == "category":
+                data[column] = pd.Categorical.from_codes(self.codes(column)[rows], categories=self.categories(column))
+            elif kind == "numeric":
+                data[column] = self.array(f"{column}/values")[rows]
+            else:
+                data[column] = [self.value(column, row) for row in rows]
+        return pd.DataFrame(data)
@@ -0,0 +1,156 @@
+import argparse
+import importlib
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# Subcommands and the pipeline modules running them. Modules are only imported when their
+# subcommand runs, so the CLI itself starts without loading pandas, TensorFlow or hugchat
+PIPELINE_COMMANDS = {
+    "download": ("prepare_data", "Download and extract the monuments data."),
+    "preprocess": ("preprocess_data", "Compute category statistics, translations, icons and the cleaned shapefile."),
+    "translate": ("add_icons_pipeline", "Translate the categories and search icons for them."),
+    "definitions": ("rag_desc_generation_pipeline", "Generate category definitions with the chatbot."),
+    "translate-definitions": ("translate_definitions_pipeline", "Translate the generated definitions to English."),
+    "image-prompts": ("image_gen_pipeline", "Generate image prompts with the chatbot."),
+    "route-matrix": ("route_matrix_pipeline", "Precompute travel matrices and tours between sevaerdigheder."),
+    "search-index": ("search_index_pipeline", "Build and benchmark the monument search index."),
+}
+
+# Modules that parse their own arguments from sys.argv. All other pipelines take no arguments, so their
+# subcommands handle --help themselves and reject extra arguments instead of starting the pipeline
+ARGUMENT_PARSING_MODULES = {"prepare_data"}
+
+# Modules without machine learning or chatbot dependencies, which must start quickly
+NON_ML_MODULES = [
+    "prepare_data",
+    "preprocess_data",
+    "rag_desc_generation_pipeline",
+    "route_matrix_pipeline",
+    "search_index_pipeline",
+]
+
+IMPORT_TIME_BUDGET_SECONDS = 1.0
+
+IMPORT_TIME_PATTERN = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_import_times(module_name: str) -> Tuple[float, List[Tuple[str, int, int]]]:
+    """
+    Imports a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        Tuple[float, List[Tuple[str, int, int]]]: The cumulative import time of the module in seconds, and
+        (package, self microseconds, cumulative microseconds) for every direct import of the module.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        cwd=Path(__file__).resolve().parent,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise ImportError(f"Could not import {module_name}: {completed.stderr.strip().splitlines()[-1]}")
+
+    # Nested imports are printed before their parent, indented by two spaces per level
+    direct_imports: List[Tuple[str, int, int]] = []
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, package = match.groups()
+        depth = (len(indent) - 1) // 2
+
+        if depth == 1:
+            direct_imports.append((package, int(self_us), int(cumulative_us)))
+        elif depth == 0:
+            if package == module_name:
+                return int(cumulative_us) / 1e6, direct_imports
+            direct_imports = []
+
+    raise ImportError(f"No import time reported for {module_name}")
+
+
+def report_import_times(args: argparse.Namespace) -> int:
+    total_seconds, top_level_imports = measure_import_times(args.module)
+
+    print(f"Import time of {args.module}: {total_seconds:.3f} seconds")
+    print(f"{'cumulative [ms]':>16} {'self [ms]':>10}  package")
+    for package, self_us, cumulative_us in sorted(top_level_imports, key=lambda item: -item[2])[: args.top]:
+        print(f"{cumulative_us / 1000:>16.1f} {self_us / 1000:>10.1f}  {package}")
+    return 0
+
+
+def check_import_budget(args: argparse.Namespace) -> int:
+    """
+    Fails if a cold import of any non machine learning module exceeds the budget.
+    """
+    import_times: Dict[str, float] = {}
+    for module_name in NON_ML_MODULES:
+        import_times[module_name], _ = measure_import_times(module_name)
+
+    over_budget = {name: seconds for name, seconds in import_times.items() if seconds > args.budget}
+    for name, seconds in import_times.items():
+        print(f"{'OVER BUDGET' if name in over_budget else 'ok':>11}  {seconds:.3f} s  {name}")
+
+    if over_budget:
+        print(f"{len(over_budget)} modules exceed the import budget of {args.budget} seconds")
+        return 1
+    return 0
+
+
+def run_pipeline(module_name: str, pipeline_args: List[str]) -> int:
+    module = importlib.import_module(module_name)
+
+    # Pipelines parse their own arguments from sys.argv
+    sys.argv = [module_name] + pipeline_args
+    module.main()
+    return 0
+
+
+def parse_cli_args() -> Tuple[argparse.Namespace, List[str]]:
+    parser = argparse.ArgumentParser(description="Run the cultural heritage data pipelines.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for command, (module_name, help_text) in PIPELINE_COMMANDS.items():
+        parses_own_arguments = module_name in ARGUMENT_PARSING_MODULES
+        subparser = subparsers.add_parser(
+            command, help=help_text, description=help_text, add_help=not parses_own_arguments
+        )
+        subparser.set_defaults(pipeline_module=module_name)
+
+    import_report_parser = subparsers.add_parser(
+        "import-report", help="Show the slowest imports of a module, measured with -X importtime."
+    )
+    import_report_parser.add_argument("module", type=str, help="The module to import, e.g. preprocess_data")
+    import_report_parser.add_argument("--top", "-t", type=int, default=15, help="Number of imports to show")
+
+    import_budget_parser = subparsers.add_parser(
+        "check-import-budget", help="Fail if a non machine learning module imports slower than the budget."
+    )
+    import_budget_parser.add_argument(
+        "--budget", "-b", type=float, default=IMPORT_TIME_BUDGET_SECONDS, help="Import time budget in seconds per module"
+    )
+
+    args, pipeline_args = parser.parse_known_args()
+    if pipeline_args and getattr(args, "pipeline_module", None) not in ARGUMENT_PARSING_MODULES:
+        parser.error(f"unrecognized arguments: {' '.join(pipeline_args)}")
+
+    return args, pipeline_args
+
+
+def main():
+    args, pipeline_args = parse_cli_args()
+
+    if args.command == "import-report":
+        sys.exit(report_import_times(args))
+    if args.command == "check-import-budget":
+        sys.exit(check_import_budget(args))
+
+    sys.exit(run_pipeline(args.pipeline_module, pipeline_args))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,6 @@ import argparse
 import mimetypes
 from pathlib import Path
 import re
-import requests
 from urllib.parse import unquote
 import zipfile
 
@@ -81,6 +80,9 @@ class FileDownloader:
         self.downloaded_file_path = file_path
 
     def download_file_from_url(self) -> None:
+        # Imported lazily, so the CLI starts without loading the HTTP stack
+        import requests
+
         logger.info(f"Attempting to download file from: {self.url}")
         try:
             logger.info("Sending GET request...")
@@ -1,36 +1,93 @@
 import os
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional
 
 import geopandas as gpd
 import pandas as pd
 
-from add_icons_pipeline import translate_dataframe_column_dk_to_en, icon_search_by_column_pipeline
+from area_statistics_utilities import ADMIN_AREA_COLUMNS, build_area_statistics
 from code_utilities import timing_decorator
-from data_processing_utilities import load_csv_as_df, export_df_as_csv, get_file_size
+from data_validation_utilities import validate_monuments_csv, validate_monuments_shapefile
+from data_processing_utilities import (
+    load_csv_as_df,
+    export_df_as_csv,
+    get_file_size,
+    encode_categorical_columns,
+    decode_categorical_columns,
+    compute_anlaegsbetydning_statistics,
+    to_shapefile_column_name,
+)
 from logging_utils import get_logger
+from monument_store_utilities import write_monument_store
+from search_index_pipeline import build_search_index
+from shapefile_ingestion_utilities import read_shapefile_in_parallel
 
 logger = get_logger(__name__)
 
-def filter_out_unnecessary_columns(input_path: Path, columns_to_remove: List[str], output_path: Path = None,) -> gpd.GeoDataFrame:
+def filter_out_unnecessary_columns(
+    input_path: Path,
+    columns_to_remove: List[str],
+    output_path: Path = None,
+    vocabularies: Optional[Dict[str, pd.CategoricalDtype]] = None,
+    num_workers: int = 1,
+    partition_output_dir: Optional[Path] = None,
+    area_statistics_output_path: Optional[Path] = None,
+    id_column: Optional[str] = None,
+) -> gpd.GeoDataFrame:
     # Handle default value for output_path when not provided..
     if output_path is None:
         output_path = input_path
 
+    # Shapefile attribute names are truncated to 10 characters, e.g. 'kommunenavn' is stored as 'kommunenav'
+    columns_to_remove = list(dict.fromkeys(to_shapefile_column_name(column) for column in columns_to_remove))
+
+    # Removed columns that are still read: the id column stays in the returned GeoDataFrame, and the
+    # kommune attributes are read for the area statistics and dropped afterwards
+    columns_read_anyway = [id_column] if id_column is not None else []
+    if area_statistics_output_path is not None:
+        columns_read_anyway += ADMIN_AREA_COLUMNS
+    columns_to_read_remove = [column for column in columns_to_remove if column not in columns_read_anyway]
+
     # Get the shapefile file size, just for clarity in the log message
     shapefile_file_size = get_file_size(input_path)
 
-    logger.info(f"Attempting to load shapefile from {input_path} ({shapefile_file_size} mb). This may take some time for large files...")
-    try:
-        gdf = gpd.read_file(input_path)
-    except Exception as e:
-        logger.error(f"Error loading shapefile from {input_path}. {e}")
-        raise
-    logger.info("Shapefile loaded successfully!")
-    
+    if num_workers > 1:
+        # Parallel ingestion, the unnecessary columns are never read from disk
+        logger.info(f"Attempting to load shapefile from {input_path} ({shapefile_file_size} mb) with {num_workers} workers...")
+        try:
+            gdf = read_shapefile_in_parallel(
+                input_path,
+                columns_to_read_remove,
+                num_workers=num_workers,
+                partition_output_dir=partition_output_dir,
+            )
+        except Exception as e:
+            logger.error(f"Error loading shapefile from {input_path}. {e}")
+            raise
+        logger.info("Shapefile loaded successfully!")
+
+        gdf = encode_categorical_columns(gdf, vocabularies=vocabularies)
+    else:
+        logger.info(f"Attempting to load shapefile from {input_path} ({shapefile_file_size} mb). This may take some time for large files...")
+        try:
+            gdf = gpd.read_file(input_path)
+        except Exception as e:
+            logger.error(f"Error loading shapefile from {input_path}. {e}")
+            raise
+        logger.info("Shapefile loaded successfully!")
+
+        gdf = encode_categorical_columns(gdf, vocabularies=vocabularies)
+
+    if area_statistics_output_path is not None:
+        gdf = build_area_statistics(gdf, area_statistics_output_path)
+
+    # Drop the columns that were read from disk but are not part of the output
+    columns_to_drop = columns_to_remove if num_workers <= 1 else [column for column in columns_to_remove if column not in columns_to_read_remove]
     logger.debug(f"GeoDataFrame head before removing columns: {gdf.head()}")
 
-    for column in columns_to_remove:
+    for column in columns_to_drop:
+        if column == id_column:
+            continue
         try:
             gdf = gdf.drop(columns=column)
         except KeyError:
@@ -38,80 +95,47 @@ def filter_out_unnecessary_columns(input_path: Path, columns_to_remove: List[str
     logger.debug(f"GeoDataFrame head after removing columns: {gdf.head()}")
     
     logger.info(f"Exporting filtered GeoDataFrame to {output_path}...")
-    gdf.to_file(output_path, driver='ESRI Shapefile')
+    # Shapefile attributes are plain strings, labels are only decoded for the export
+    export_columns = [column for column in gdf.columns if column != id_column or column not in columns_to_remove]
+    decode_categorical_columns(gdf[export_columns]).to_file(output_path, driver='ESRI Shapefile')
 
     return gdf
 
 
 def main():
+    # Imported lazily, the translation pipeline pulls in TensorFlow and transformers
+    from add_icons_pipeline import translate_dataframe_column_dk_to_en, icon_search_by_column_pipeline
+
     input_csv_path = (
         Path(__file__).resolve().parents[1] / "data" / "input" / "anlaeg_all_25832.csv"
     )
 
-    columns = ["anlaegsbetydning"]
-    dtypes = {"anlaegsbetydning": str}
-
-    # Load the CSV file as a DataFrame
+    # Load the CSV file as a DataFrame, dictionary encoding the label columns while parsing
     df = load_csv_as_df(
         input_csv_path,
         csv_encoding="ISO-8859-1",
         columns_to_load=None,
-        column_dtypes=None,
-    )
-
-    # Calculate value counts
-    value_counts = df.loc[:, "anlaegsbetydning"].value_counts()
-
-    # Calculate the most common datering for each anlaegsbetydning
-    most_common_datering = df.groupby("anlaegsbetydning")["datering"].agg(
-        pd.Series.mode
-    )
-    most_common_datering_df = most_common_datering.reset_index()
-
-    datering_distribution_per_group = df.groupby("anlaegsbetydning")[
-        "datering"
-    ].value_counts()
-
-    # Convert the series into a DataFrame
-    datering_distribution_per_group_df = datering_distribution_per_group.reset_index(
-        name="count"
-    )
-
-    # Convert 'datering' and 'count' into a dictionary grouped by 'anlaegsbetydning'
-    datering_distribution_dict = (
-        datering_distribution_per_group_df.groupby("anlaegsbetydning")[[
-            "datering", "count"
-        ]]
-        .apply(
-            lambda x: (
-                dict(zip(x["datering"], x["count"]))
-                if "datering" in x.columns and "count" in x.columns
-                else {}
-            )
-        )
-        .reset_index(name="datering_distributions")
+        column_dtypes={"anlaegsbetydning": "category", "datering": "category", "kommunenavn": "category"},
     )
 
-    # Create a new DataFrame
-    value_counts_df = value_counts.reset_index()
+    # Initialize input/output paths
+    shapefile_path = Path(__file__).resolve().parents[1] / "data" / "input" / "anlaeg_all_25832.shp"
+    cleaned_shapefile_output_path = Path(__file__).resolve().parents[1] / "data" / "output" / "cleaned_anlaeg_all_25832.shp"
 
-    # Merge value_counts_df and most_common_datering_df on 'anlaegsbetydning'
-    value_counts_df = value_counts_df.merge(
-        most_common_datering_df, on="anlaegsbetydning", how="left"
-    )
+    # Define columns to filter
+    # 'sevaerdighedsklasse' is kept on purpose, the R app and the route matrix select the sevaerdigheder by it
+    columns_to_delete = ["systemnr", "stednr", "loknr", "sbext", "frednr", "anlnr", "anlaegstyp", "dateringskode", "fra_aar", "til_aar", "kommunenavn", "kommunenr"]
 
-    # Merge value_counts_df and datering_distribution_dict on 'anlaegsbetydning'
-    value_counts_df = value_counts_df.merge(
-        datering_distribution_dict, on="anlaegsbetydning", how="left"
-    )
+    # Validate both inputs before the expensive translation and icon stages, and stop at the first input with errors
+    for validate in (
+        lambda: validate_monuments_csv(df, source=input_csv_path.name),
+        lambda: validate_monuments_shapefile(shapefile_path, columns_to_remove=columns_to_delete),
+    ):
+        report = validate()
+        report.save(Path(__file__).resolve().parents[1] / "data" / "output" / "validation" / f"{report.source}.json")
+        report.raise_for_errors()
 
-    # Rename the columns
-    value_counts_df.columns = [
-        "anlaegsbetydning",
-        "counts",
-        "most_frequent_datering",
-        "datering_distributions",
-    ]
+    value_counts_df = compute_anlaegsbetydning_statistics(df)
 
     english_translations_df = translate_dataframe_column_dk_to_en(
         df=value_counts_df,
@@ -121,9 +145,6 @@ def main():
 
     icon_df = icon_search_by_column_pipeline(english_translations_df, "en_anlaegsbetydning")
 
-    # Just try and encode this too, idk why it doesn't work
-    df['anlaegsbetydning'] = df['anlaegsbetydning'].str.encode('ISO-8859-1').str.decode('ISO-8859-1')
-
     export_df_as_csv(
         icon_df,
         directory=Path(__file__).resolve().parents[1] / "data" / "output",
@@ -131,14 +152,18 @@ def main():
         encoding="ISO-8859-1",
     )
 
-    # Initialize input/output paths
-    shapefile_path = Path(__file__).resolve().parents[1] / "data" / "input" / "anlaeg_all_25832.shp"
-    cleaned_shapefile_output_path = Path(__file__).resolve().parents[1] / "data" / "output" / "cleaned_anlaeg_all_25832.shp"
+    # Build the search index while the kommune names are still available, they are dropped from the shapefile below
+    search_index = build_search_index(df, icon_df)
+    search_index.save(Path(__file__).resolve().parents[1] / "data" / "output" / "search_index.pkl")
 
-    # Define columns to filter
-    columns_to_delete = ["systemnr", "stednr", "loknr", "sbext", "frednr", "anlnr", "anlaegstyp", "dateringskode", "fra_aar", "til_aar", "kommunenavn", "kommunenr", "sevaerdighedsklasse"]
+    # Share the label vocabularies of the CSV with the shapefile, so both use the same category codes
+    vocabularies = {column: df[column].dtype for column in ["anlaegsbetydning", "datering"]}
+
+    gdf = filter_out_unnecessary_columns(shapefile_path, columns_to_delete, cleaned_shapefile_output_path, vocabularies=vocabularies, num_workers=os.cpu_count() or 1, area_statistics_output_path=Path(__file__).resolve().parents[1] / "data" / "output" / "area_statistics.json", id_column="systemnr")
 
-    gdf = filter_out_unnecessary_columns(shapefile_path, columns_to_delete, cleaned_shapefile_output_path) 
+    # Shared, memory-mapped copy of the cleaned monuments for the app workers and later pipeline stages
+    # The store ids are the systemnr, the same ids the search index uses
+    write_monument_store(gdf, Path(__file__).resolve().parents[1] / "data" / "output" / "monuments.store", id_column="systemnr")
 
     logger.info("Script completed!")
 
@@ -1,24 +1,42 @@
+from __future__ import annotations
+
 import os
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
-from hugchat import hugchat
-from hugchat.login import Login
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
+from chatbot_resilience_utilities import (
+    CircuitBreaker,
+    call_with_retries,
+    generation_status_from_error,
+    GENERATION_STATUS_FATAL_ERROR,
+    GENERATION_STATUS_RETRIES_EXHAUSTED,
+    GENERATION_STATUS_SUCCESS,
+)
 from data_processing_utilities import (
-    load_csv_as_df,
-    export_df_as_csv,
     add_empty_columns_to_df,
+    compact_csv_patches,
+    KeyedTable,
+    load_csv_with_patches,
+    persist_upserted_rows,
 )
+from llm_cache_utilities import ResponseCache, group_near_identical_labels
 from logging_utils import get_logger
 
+if TYPE_CHECKING:
+    from hugchat import hugchat
+
 logger = get_logger(__name__)
 logger.propagate = False
 
+CHATBOT_BACKEND = "hugchat"
+REQUEST_TIMEOUT_SECONDS = 180
+MAX_RETRIES = 3
+
 PROMPT = "Din opgave er at generere en general kort definition af en specifik type fortidsminde. Definitionen bør være 1-2 linjer. Definitionen skal bruges til en spændende app som skal engagere danskere i kulturarv."
 
 
@@ -53,15 +71,27 @@ def combine_chunk_files(
 
 
 def process_chunk_from_df(
-    chunk, chatbot: hugchat.ChatBot
-) -> List[Tuple[str, List[str]]]:
+    chunk,
+    chatbot: hugchat.ChatBot,
+    response_cache: Optional[ResponseCache] = None,
+    label_groups: Optional[Dict[str, str]] = None,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+) -> List[Tuple[str, List[str], str]]:
     results = []
     for value in tqdm(chunk["anlaegsbetydning"], desc="Processing values"):
+        # Reuse the generation of the group representative for near-identical labels
+        if label_groups is not None:
+            value = label_groups.get(value, value)
         try:
-            result = generate_anlaegsbetydning_pipeline(value, chatbot)
+            result = generate_anlaegsbetydning_pipeline(
+                value,
+                chatbot,
+                response_cache=response_cache,
+                circuit_breaker=circuit_breaker,
+            )
         except Exception as e:
             logger.info(f"Failed to process value {value}: {e}")
-            result = (np.nan, np.nan)
+            result = (np.nan, np.nan, GENERATION_STATUS_FATAL_ERROR)
         results.append(result)
     return results
 
@@ -70,77 +100,163 @@ def construct_hf_query(anlaegstype: str, prompt: str) -> str:
     return f"{prompt} TYPE: {anlaegstype}"
 
 
+def start_new_conversation(chatbot: hugchat.ChatBot) -> None:
+    """
+    Switches the chatbot to a new conversation after a timed out attempt.
+
+    The abandoned attempt is still streaming its answer into the old conversation, so a retry in the same
+    conversation would send a second message into it concurrently. The new conversation uses the default
+    model, the same one create_hf_chatbot starts with.
+    """
+    logger.info("Starting a new conversation for the retry of a timed out request...")
+    chatbot.new_conversation(switch_to=True)
+
+
 def prompt_hf_chatbot(
-    chatbot: hugchat.ChatBot, prompt: str, use_web_search: bool = True
+    chatbot: hugchat.ChatBot,
+    prompt: str,
+    use_web_search: bool = True,
+    circuit_breaker: Optional[CircuitBreaker] = None,
 ) -> hugchat.Message:
-    logger.debug(f"Prompting chatbot with the following message: {prompt}...")
-    message = chatbot.chat(prompt, web_search=use_web_search)
-    logger.debug("Message sent to chatbot.")
-    message.wait_until_done()
-    logger.debug("Chatbot processing completed.")
-    return message
+    """
+    Prompts the chatbot and waits for the answer, with a deadline per attempt and retries with backoff.
+
+    Raises:
+        RetriesExhaustedError: If every attempt failed with a retryable error or timed out.
+        Exception: The original exception if the error is classified as fatal.
+    """
+
+    def send_and_wait() -> hugchat.Message:
+        logger.debug(f"Prompting chatbot with the following message: {prompt}...")
+        message = chatbot.chat(prompt, web_search=use_web_search)
+        logger.debug("Message sent to chatbot.")
+        message.wait_until_done()
+        logger.debug("Chatbot processing completed.")
+        return message
+
+    return call_with_retries(
+        send_and_wait,
+        timeout_seconds=REQUEST_TIMEOUT_SECONDS,
+        max_retries=MAX_RETRIES,
+        circuit_breaker=circuit_breaker,
+        on_timeout=lambda: start_new_conversation(chatbot),
+    )
 
 
 def generate_anlaegsbetydning_pipeline(
-    value: str, chatbot_instance: hugchat.ChatBot, use_web_search: bool = True
-) -> Union[str, Tuple[str, List[str]]]:
+    value: str,
+    chatbot_instance: hugchat.ChatBot,
+    use_web_search: bool = True,
+    response_cache: Optional[ResponseCache] = None,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+) -> Tuple[str, List[str], str]:
     """
     This function generates a pipeline for anlaegsbetydning.
 
     Parameters:
     value (str): The value to process.
     use_web_search (bool): Flag to indicate whether to use web search or not. Default is True.
+    response_cache (Optional[ResponseCache]): Cache to look up and store responses in. Default is None.
+    circuit_breaker (Optional[CircuitBreaker]): Breaker pausing all calls while the backend is degraded. Default is None.
 
     Returns:
-    Union[str, Tuple[str, List[str]]]: Returns the definition and optionally the sources if web search is enabled.
+    Tuple[str, List[str], str]: Returns the definition, the web search sources (empty if web search is disabled)
+    and the generation status. The definition is NaN if the generation failed.
     """
+    prompt = construct_hf_query(value, PROMPT)
+    model = getattr(chatbot_instance, "active_model", None)
+
+    if response_cache is not None:
+        cached_result = response_cache.get(CHATBOT_BACKEND, model, prompt)
+        if cached_result is not None:
+            logger.info(f"Using cached definition for anlaegsbetydning: {value}")
+            definition, sources = cached_result
+            return definition, sources, GENERATION_STATUS_SUCCESS
+
+    definition, sources, status = _generate_anlaegsbetydning_definition(
+        value, chatbot_instance, prompt, use_web_search, circuit_breaker
+    )
+
+    # Never cache failed generations, these should be retried on the next run
+    if response_cache is not None and status == GENERATION_STATUS_SUCCESS:
+        response_cache.set(CHATBOT_BACKEND, model, prompt, [definition, sources])
+
+    return definition, sources, status
+
+
+def _generate_anlaegsbetydning_definition(
+    value: str,
+    chatbot_instance: hugchat.ChatBot,
+    prompt: str,
+    use_web_search: bool,
+    circuit_breaker: Optional[CircuitBreaker],
+) -> Tuple[str, List[str], str]:
     logger.info(f"Attempting to process anlaegsbetydning: {value}...")
     try:
         message = prompt_hf_chatbot(
             chatbot=chatbot_instance,
-            prompt=construct_hf_query(value, PROMPT),
+            prompt=prompt,
             use_web_search=use_web_search,
+            circuit_breaker=circuit_breaker,
         )
+    except Exception as e:
+        status = generation_status_from_error(e)
+        logger.error(
+            f"An error occurred while generating anlaegsbetydning pipeline ({status}): {e}"
+        )
+        return np.nan, [], status
 
-        definition = message.get_final_text()
-        logger.debug(f"Final text from chatbot: {definition}")
+    definition = message.get_final_text()
+    logger.debug(f"Final text from chatbot: {definition}")
 
-        if message.search_enabled():
-            try:
-                sources = [source.link for source in message.get_search_sources()]
-                if not sources:
-                    logger.warning(
-                        f"No web search sources returned for anlaegstype {value}"
-                    )
-                logger.info(
-                    f"Successfully generated RAG definition for anlaegstype {value}. Returning definition and sources..."
-                )
-                return definition, sources
-            except Exception as e:
-                logger.error(
-                    f"An error occurred while getting search sources: {e}. Returning definition and empty list..."
+    if message.search_enabled():
+        try:
+            sources = [source.link for source in message.get_search_sources()]
+            if not sources:
+                logger.warning(
+                    f"No web search sources returned for anlaegstype {value}"
                 )
-                return definition, []
+            logger.info(
+                f"Successfully generated RAG definition for anlaegstype {value}. Returning definition and sources..."
+            )
+            return definition, sources, GENERATION_STATUS_SUCCESS
+        except Exception as e:
+            logger.error(
+                f"An error occurred while getting search sources: {e}. Returning definition and empty list..."
+            )
+            return definition, [], GENERATION_STATUS_SUCCESS
 
-        logger.info(f"Successfully generated definition for anlaegstype {value}")
-        return definition
-    except Exception as e:
-        logger.error(
-            f"An error occurred while generating anlaegsbetydning pipeline: {e}"
-        )
-        if use_web_search:
-            return f"ERROR {e}: COULD NOT GENERATE DEFINITION", []
-        else:
-            return f"ERROR {e}: COULD NOT GENERATE DEFINITION"
+    logger.info(f"Successfully generated definition for anlaegstype {value}")
+    return definition, [], GENERATION_STATUS_SUCCESS
+
+
+def add_generation_status_column(
+    df: pd.DataFrame, column: str = "definition", status_column: str = "generation_status"
+) -> pd.DataFrame:
+    """
+    Adds the structured status column to tables written before it existed.
+
+    Legacy "ERROR ...: COULD NOT GENERATE DEFINITION" sentinel strings are replaced by NaN
+    and marked as retryable failures, so they are picked up again by the next run.
+    """
+    if status_column in df.columns or column not in df.columns:
+        return df
+
+    legacy_error_mask = df[column].str.startswith("ERROR", na=False)
+    df[status_column] = np.where(df[column].notna(), GENERATION_STATUS_SUCCESS, None)
+    df.loc[legacy_error_mask, status_column] = GENERATION_STATUS_RETRIES_EXHAUSTED
+    df.loc[legacy_error_mask, column] = np.nan
+
+    logger.info(f"Added '{status_column}' column, migrated {legacy_error_mask.sum()} legacy error values")
+    return df
 
 
 def filter_unprocessed_rows_base(
-    df: pd.DataFrame, columns: List[Tuple[str, bool]]
+    df: pd.DataFrame, columns: List[str], status_column: str = "generation_status"
 ) -> pd.DataFrame:
-    conditions = [df[column[0]].isna() for column in columns]
-    conditions.extend(
-        [df[column[0]].str.contains("ERROR") for column in columns if column[1]]
-    )
+    conditions = [df[column].isna() for column in columns]
+    if status_column in df.columns:
+        conditions.append(df[status_column] != GENERATION_STATUS_SUCCESS)
     return df[np.logical_or.reduce(conditions)]
 
 
@@ -153,6 +269,9 @@ def generate_definitions_from_dataframe(
     output_dir: Optional[Path] = None,
     num_rows: Optional[int] = None,
     process_unprocessed_only: bool = True,
+    response_cache: Optional[ResponseCache] = None,
+    group_similar_labels: bool = False,
+    circuit_breaker: Optional[CircuitBreaker] = None,
 ) -> pd.DataFrame:
     if chunk_dir is None:
         chunk_dir = Path(__file__).resolve().parents[0]
@@ -160,14 +279,30 @@ def generate_definitions_from_dataframe(
     if output_dir is None:
         output_dir = Path(__file__).resolve().parents[0]
 
+    label_groups = None
+    if group_similar_labels:
+        label_groups = group_near_identical_labels(input_df["anlaegsbetydning"])
+        grouped_label_count = sum(label != representative for label, representative in label_groups.items())
+        logger.info(f"Grouped {grouped_label_count} labels with a near-identical label")
+        if response_cache is not None:
+            response_cache.record_grouped_labels(grouped_label_count)
+
+    # Share one breaker between all calls, so a degraded backend pauses the whole run
+    if circuit_breaker is None:
+        circuit_breaker = CircuitBreaker()
+
+    input_df = add_generation_status_column(input_df)
+
     if use_chunks:
         if process_unprocessed_only:
             filtered_df = filter_unprocessed_rows_base(
-                input_df, [("definition", True), ("web_search_sources", False)]
+                input_df, ["definition", "web_search_sources"]
             )
         else:
             # Add empty columns to the original DataFrame for updating
-            filtered_df = add_empty_columns_to_df(input_df, ["definition", "web_search_sources"])
+            filtered_df = add_empty_columns_to_df(
+                input_df, ["definition", "web_search_sources", "generation_status"]
+            )
 
         try:
             
@@ -178,14 +313,21 @@ def generate_definitions_from_dataframe(
                 filtered_df.groupby(chunk_indices), desc="Processing chunks"
             ):
                 logger.info(f"Processing chunk {chunk_id}...")
-                generation_results = process_chunk_from_df(chunk, chatbot)
+                generation_results = process_chunk_from_df(
+                    chunk,
+                    chatbot,
+                    response_cache=response_cache,
+                    label_groups=label_groups,
+                    circuit_breaker=circuit_breaker,
+                )
 
-                # Unpack the results into two lists
-                definitions, web_search_sources = map(list, zip(*generation_results))
+                # Unpack the results into three lists
+                definitions, web_search_sources, statuses = map(list, zip(*generation_results))
 
                 # Add the lists as new columns to the chunk
                 chunk["definition"] = definitions
                 chunk["web_search_sources"] = web_search_sources
+                chunk["generation_status"] = statuses
 
                 # Save the chunk to a file
                 chunk.to_csv(chunk_dir / f"chunk_{chunk_id}.csv", index=False)
@@ -195,21 +337,27 @@ def generate_definitions_from_dataframe(
             # Combine all generated chunk csv files into a single DataFrame
             chunk_df = combine_chunk_files(chunk_dir=chunk_dir, output_path=chunk_dir)
 
-            # Set the 'anlaegsbetydning' column as the index for both DataFrames
-            input_df.set_index('anlaegsbetydning', inplace=True)
-            chunk_df.set_index('anlaegsbetydning', inplace=True)
-
-            # Create a mask for updating only rows where definition column contains error, or is empty
-            mask = input_df['definition'].str.contains("ERROR") | input_df['definition'].isna()
-
-            # Update the values using loc
-            input_df.loc[mask, ['definition', 'web_search_sources']] = chunk_df.loc[input_df[mask].index, ['definition', 'web_search_sources']]
-
-            # Reset the index in input_df
-            input_df.reset_index(inplace=True)
+            # Merge the new results by key, only rows that actually changed are updated
+            definitions_table = KeyedTable(
+                input_df,
+                key_column="anlaegsbetydning",
+                value_columns=["definition", "web_search_sources", "generation_status"],
+                # A regenerated definition needs a new translation
+                dependent_columns=["en_definition"],
+            )
+            updated_rows, inserted_rows = definitions_table.upsert(chunk_df)
+            input_df = definitions_table.df
+
+            # Append or patch the changed rows instead of rewriting the whole CSV file
+            persist_upserted_rows(
+                input_df,
+                updated_rows,
+                inserted_rows,
+                output_dir / "anlaegsbetydning_with_definitions.csv",
+            )
 
-            # Export the updated DataFrame to a CSV file
-            export_df_as_csv(input_df, output_dir, "anlaegsbetydning_with_definitions.csv")
+            if response_cache is not None:
+                response_cache.log_stats()
 
             return input_df
     else:
@@ -221,36 +369,77 @@ def generate_definitions_from_dataframe(
         generated_results = []
 
         for value in tqdm(input_df["anlaegsbetydning"].iloc[:num_rows]):
+            if label_groups is not None:
+                value = label_groups.get(value, value)
             try:
-                generation = generate_anlaegsbetydning_pipeline(value, chatbot)
+                generation = generate_anlaegsbetydning_pipeline(
+                    value,
+                    chatbot,
+                    response_cache=response_cache,
+                    circuit_breaker=circuit_breaker,
+                )
             except Exception as e:
                 logger.info(f"Failed to process value {value}: {e}")
-                generation = (np.nan, np.nan)
+                generation = (np.nan, np.nan, GENERATION_STATUS_FATAL_ERROR)
 
             generated_results.append(generation)
 
         # Add np.nan for the remaining rows
-        generated_results += [(np.nan, np.nan)] * (len(input_df) - num_rows)
+        generated_results += [(np.nan, np.nan, np.nan)] * (len(input_df) - num_rows)
 
-        # Unpack the results into two lists
-        definitions, web_search_sources = map(list, zip(*generated_results))
+        # Unpack the results into three lists
+        definitions, web_search_sources, statuses = map(list, zip(*generated_results))
 
         # Add the lists as new columns to the DataFrame
         input_df["definition"] = definitions
         input_df["web_search_sources"] = web_search_sources
+        input_df["generation_status"] = statuses
+
+        if response_cache is not None:
+            response_cache.log_stats()
 
     return input_df
 
 
-def main():
+def create_hf_chatbot(env_file_path: Path, cookie_path_dir: str = "./cookies/") -> hugchat.ChatBot:
+    """
+    Signs in to HuggingChat with the credentials from an .env file and creates a chatbot instance.
+
+    Parameters:
+        env_file_path (Path): The .env file holding the EMAIL and PASSWORD variables.
+        cookie_path_dir (str): The directory to save the login cookies in. Note: trailing slash (/) is required to avoid errors.
+
+    Returns:
+        hugchat.ChatBot: The signed in chatbot.
+    """
+    # Imported lazily, so importing this module does not load the chatbot client or sign in
+    from hugchat import hugchat
+    from hugchat.login import Login
+
     # Load environment variables from .env file
-    env_file_path = Path(__file__).resolve().parents[1] / "data" / "hf_creds.env"
     load_dotenv(dotenv_path=env_file_path)
 
     # Get environment variables for HF sign in
     EMAIL = os.getenv("EMAIL")
     PASSWD = os.getenv("PASSWORD")
 
+    sign = Login(EMAIL, PASSWD)
+    cookies = sign.login(cookie_dir_path=cookie_path_dir, save_cookies=True)
+
+    # Create a chatbot instance
+    chatbot = hugchat.ChatBot(
+        cookies=cookies.get_dict()
+    )  # or cookie_path="usercookies/<email>.json"
+
+    logger.info(
+        f"Created chatbot instance using the following model: {chatbot.active_model}"
+    )
+    return chatbot
+
+
+def main():
+    env_file_path = Path(__file__).resolve().parents[1] / "data" / "hf_creds.env"
+
     # Load fortidsminder data, anlaegsbetydninger for descriptions
     input_directory_path = Path(__file__).resolve().parents[1] / "data" / "output"
     input_csv_path = input_directory_path / "anlaegsbetydning_value_counts.csv"
@@ -261,22 +450,12 @@ def main():
     chunk_output_dir = Path(__file__).resolve().parents[1] / "data" / "output" / "temp"
     chunk_output_dir.mkdir(parents=True, exist_ok=True)
 
-    df = load_csv_as_df(processed_csv_path)
+    # Persistent cache of chatbot responses, shared between runs
+    response_cache = ResponseCache(output_path / "llm_response_cache.jsonl")
 
-    cookie_path_dir = (
-        "./cookies/"  # Note: trailing slash (/) is required to avoid errors
-    )
-    sign = Login(EMAIL, PASSWD)
-    cookies = sign.login(cookie_dir_path=cookie_path_dir, save_cookies=True)
+    df = load_csv_with_patches(processed_csv_path, key_column="anlaegsbetydning")
 
-    # Create a chatbot instance
-    chatbot = hugchat.ChatBot(
-        cookies=cookies.get_dict()
-    )  # or cookie_path="usercookies/<email>.json"
-
-    logger.info(
-        f"Created chatbot instance using the following model: {chatbot.active_model}"
-    )
+    chatbot = create_hf_chatbot(env_file_path)
 
     processed_df = generate_definitions_from_dataframe(
         input_df=df,
@@ -285,9 +464,11 @@ def main():
         chunk_dir=chunk_output_dir,
         output_dir=output_path,
         num_rows=None,
+        response_cache=response_cache,
     )
 
-    # export_df_as_csv(processed_df, output_path, "anlaegsbetydning_with_definitions.csv")
+    # Fold pending patches into the CSV file once they make up a sizeable share of it
+    compact_csv_patches(processed_csv_path, key_column="anlaegsbetydning", min_patch_ratio=0.25)
 
 
 if __name__ == "__main__":
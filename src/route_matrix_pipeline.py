@@ -0,0 +1,318 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from code_utilities import timing_decorator
+from logging_utils import get_logger
+from monument_store_utilities import MonumentStore
+
+logger = get_logger(__name__)
+
+# Projected CRS of the monuments data, distances are computed in metres in this CRS
+METRIC_CRS = "EPSG:25832"
+
+# Approximate road network per transport mode: straight line distances are multiplied by a
+# detour factor and travelled at an average speed. Keys match the Mapbox routing profiles used by the app
+TRANSPORT_MODES = {
+    "driving": {"speed_kmh": 50.0, "detour_factor": 1.35},
+    "cycling": {"speed_kmh": 15.0, "detour_factor": 1.25},
+    "walking": {"speed_kmh": 5.0, "detour_factor": 1.2},
+}
+
+
+def select_sevaerdigheder(gdf: gpd.GeoDataFrame, sevaerdighed_column: str = "sevaerdigh") -> gpd.GeoDataFrame:
+    """
+    Selects the monuments classified as sevaerdigheder, the same filter as the map app uses.
+    """
+    sevaerdigheder = gdf[gdf[sevaerdighed_column].notna() & ~gdf.geometry.is_empty]
+    logger.info(f"Selected {len(sevaerdigheder)} sevaerdigheder out of {len(gdf)} monuments")
+    return sevaerdigheder
+
+
+@timing_decorator(logger=logger)
+def compute_neighbour_distances(
+    x: np.ndarray,
+    y: np.ndarray,
+    max_distance_m: float,
+    max_neighbours: int,
+    block_size: int = 1024,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds the nearest neighbours within max_distance_m of every point, with a sweep over the x coordinates.
+
+    Parameters:
+        x (np.ndarray): The x coordinates in metres.
+        y (np.ndarray): The y coordinates in metres.
+        max_distance_m (float): The largest straight line distance between neighbours.
+        max_neighbours (int): The largest number of neighbours kept per point.
+        block_size (int): The number of points compared at once. Default is 1024.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The neighbour lists in CSR format, i.e. the row offsets,
+        the neighbour indices and the straight line distances, sorted by distance within every row.
+    """
+    point_count = len(x)
+    order = np.argsort(x, kind="stable")
+    sorted_x, sorted_y = x[order], y[order]
+
+    rows, columns, distances = [], [], []
+    for block_start in range(0, point_count, block_size):
+        block_stop = min(block_start + block_size, point_count)
+
+        # Only points within max_distance_m along the x axis can be neighbours of the block
+        window_start = np.searchsorted(sorted_x, sorted_x[block_start] - max_distance_m, side="left")
+        window_stop = np.searchsorted(sorted_x, sorted_x[block_stop - 1] + max_distance_m, side="right")
+
+        block_distances = np.hypot(
+            sorted_x[block_start:block_stop, None] - sorted_x[None, window_start:window_stop],
+            sorted_y[block_start:block_stop, None] - sorted_y[None, window_start:window_stop],
+        )
+        block_rows, block_columns = np.nonzero(block_distances <= max_distance_m)
+
+        row_indices = order[block_start + block_rows]
+        column_indices = order[window_start + block_columns]
+        is_other_point = row_indices != column_indices
+
+        rows.append(row_indices[is_other_point])
+        columns.append(column_indices[is_other_point])
+        distances.append(block_distances[block_rows, block_columns][is_other_point])
+
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+    columns = np.concatenate(columns) if columns else np.empty(0, dtype=np.int64)
+    distances = np.concatenate(distances) if distances else np.empty(0)
+
+    # Sort by row, then by distance, and keep the nearest max_neighbours of every row
+    sort_order = np.lexsort((distances, rows))
+    rows, columns, distances = rows[sort_order], columns[sort_order], distances[sort_order]
+
+    row_counts = np.bincount(rows, minlength=point_count)
+    row_starts = np.concatenate([[0], np.cumsum(row_counts)[:-1]])
+    rank_in_row = np.arange(len(rows)) - row_starts[rows]
+    is_kept = rank_in_row < max_neighbours
+    rows, columns, distances = rows[is_kept], columns[is_kept], distances[is_kept]
+
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=point_count))])
+    return indptr.astype(np.int64), columns.astype(np.int32), distances.astype(np.float32)
+
+
+def compute_path_length(path: List[int], distance_matrix: np.ndarray) -> float:
+    return float(sum(distance_matrix[a, b] for a, b in zip(path[:-1], path[1:])))
+
+
+def order_tour(distance_matrix: np.ndarray) -> List[int]:
+    """
+    Orders an open tour starting at node 0 with a greedy nearest neighbour tour, improved by 2-opt.
+
+    Parameters:
+        distance_matrix (np.ndarray): The pairwise distances between the nodes of the tour.
+
+    Returns:
+        List[int]: The nodes in visiting order, starting with node 0.
+    """
+    node_count = len(distance_matrix)
+
+    # Greedy nearest neighbour tour
+    path = [0]
+    unvisited = set(range(1, node_count))
+    while unvisited:
+        current = path[-1]
+        next_node = min(unvisited, key=lambda node: distance_matrix[current, node])
+        path.append(next_node)
+        unvisited.remove(next_node)
+
+    # 2-opt, reversing path[i..j] while that shortens the path. The start stays fixed and the end is open
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, node_count - 1):
+            for j in range(i + 1, node_count):
+                delta = distance_matrix[path[i - 1], path[j]] - distance_matrix[path[i - 1], path[i]]
+                if j + 1 < node_count:
+                    delta += distance_matrix[path[i], path[j + 1]] - distance_matrix[path[j], path[j + 1]]
+                if delta < -1e-9:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    improved = True
+
+    return path
+
+
+@timing_decorator(logger=logger)
+def compute_neighbourhood_tours(
+    x: np.ndarray, y: np.ndarray, neighbour_indptr: np.ndarray, neighbour_indices: np.ndarray, max_tour_size: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Orders a tour through every sight and its nearest neighbours, starting at the sight itself.
+
+    The detour factor and speed are the same for every leg of a tour, so the ordering is shared by all transport modes.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The tours in CSR format, i.e. the row offsets and the sight indices in visiting order.
+    """
+    tours = []
+    for point in tqdm(range(len(x)), desc="Ordering tours"):
+        neighbours = neighbour_indices[neighbour_indptr[point]:neighbour_indptr[point + 1]]
+        members = np.concatenate([[point], neighbours[: max_tour_size - 1]]).astype(np.int64)
+
+        member_distances = np.hypot(
+            x[members, None] - x[None, members], y[members, None] - y[None, members]
+        )
+        tours.append(members[order_tour(member_distances)])
+
+    tour_indptr = np.concatenate([[0], np.cumsum([len(tour) for tour in tours])])
+    tour_indices = np.concatenate(tours) if tours else np.empty(0)
+    return tour_indptr.astype(np.int64), tour_indices.astype(np.int32)
+
+
+def build_route_matrix(
+    sevaerdigheder: gpd.GeoDataFrame,
+    output_path: Path,
+    id_column: Optional[str] = None,
+    max_distance_m: float = 20000.0,
+    max_neighbours: int = 50,
+    max_tour_size: int = 12,
+) -> None:
+    """
+    Precomputes approximate travel distances and times between nearby sevaerdigheder, and tour orderings
+    of their neighbourhoods, and stores them in one compressed .npz file.
+
+    Parameters:
+        sevaerdigheder (gpd.GeoDataFrame): The sevaerdigheder layer.
+        output_path (Path): The path of the .npz file to write.
+        id_column (Optional[str]): The column identifying a sight. Defaults to the row position.
+        max_distance_m (float): The largest straight line distance between neighbours. Default is 20 km,
+            the largest search radius of the app.
+        max_neighbours (int): The largest number of neighbours stored per sight. Default is 50.
+        max_tour_size (int): The number of sights in a precomputed tour, including the start. Default is 12,
+            the waypoint limit of the optimized route service used by the app.
+    """
+    sevaerdigheder = sevaerdigheder.to_crs(METRIC_CRS)
+
+    # Use the representative point, so non-point geometries also get a location on the geometry
+    points = sevaerdigheder.geometry.representative_point()
+    x, y = points.x.to_numpy(), points.y.to_numpy()
+
+    # Integer ids, so the file loads without pickle
+    ids = sevaerdigheder[id_column].to_numpy(dtype=np.int64) if id_column else np.arange(len(sevaerdigheder))
+
+    logger.info(f"Computing neighbours within {max_distance_m} m for {len(x)} sevaerdigheder...")
+    neighbour_indptr, neighbour_indices, straight_line_distances = compute_neighbour_distances(
+        x, y, max_distance_m, max_neighbours
+    )
+
+    arrays: Dict[str, np.ndarray] = {
+        "ids": ids,
+        "x": x,
+        "y": y,
+        "neighbour_indptr": neighbour_indptr,
+        "neighbour_indices": neighbour_indices,
+        "straight_line_distance_m": straight_line_distances,
+    }
+    for mode, parameters in TRANSPORT_MODES.items():
+        road_distances = straight_line_distances * np.float32(parameters["detour_factor"])
+        arrays[f"{mode}_distance_m"] = road_distances
+        arrays[f"{mode}_duration_s"] = road_distances / np.float32(parameters["speed_kmh"] / 3.6)
+
+    logger.info(f"Ordering tours of up to {max_tour_size} sevaerdigheder...")
+    arrays["tour_indptr"], arrays["tour_indices"] = compute_neighbourhood_tours(
+        x, y, neighbour_indptr, neighbour_indices, max_tour_size
+    )
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(output_path, **arrays)
+    logger.info(f"Saved route matrix with {len(neighbour_indices)} sight pairs to {output_path}")
+
+
+class RouteMatrix:
+    """
+    Lookup API over a route matrix file written by build_route_matrix.
+    """
+
+    def __init__(self, path: Path):
+        with np.load(path) as data:
+            self.arrays = {name: data[name] for name in data.files}
+        self.ids = self.arrays["ids"]
+        self.x = self.arrays["x"]
+        self.y = self.arrays["y"]
+
+    def nearest_sight(self, x: float, y: float) -> int:
+        """
+        Returns the index of the sight closest to a location given in METRIC_CRS.
+        """
+        return int(np.argmin((self.x - x) ** 2 + (self.y - y) ** 2))
+
+    def neighbours(self, sight: int, mode: str = "driving") -> pd.DataFrame:
+        start, stop = self.arrays["neighbour_indptr"][sight:sight + 2]
+        indices = self.arrays["neighbour_indices"][start:stop]
+        return pd.DataFrame(
+            {
+                "id": self.ids[indices],
+                "distance_m": self.arrays[f"{mode}_distance_m"][start:stop],
+                "duration_s": self.arrays[f"{mode}_duration_s"][start:stop],
+            }
+        )
+
+    def travel(self, origin: int, destination: int, mode: str = "driving") -> Optional[Tuple[float, float]]:
+        """
+        Returns the approximate (distance in metres, duration in seconds) between two sights,
+        or None if the destination is not among the precomputed neighbours of the origin.
+        """
+        start, stop = self.arrays["neighbour_indptr"][origin:origin + 2]
+        matches = np.flatnonzero(self.arrays["neighbour_indices"][start:stop] == destination)
+        if len(matches) == 0:
+            return None
+        position = start + matches[0]
+        return (
+            float(self.arrays[f"{mode}_distance_m"][position]),
+            float(self.arrays[f"{mode}_duration_s"][position]),
+        )
+
+    def tour(self, sight: int, mode: str = "driving") -> Tuple[np.ndarray, float, float]:
+        """
+        Returns the ids of the precomputed tour starting at a sight, with its total distance and duration.
+        """
+        start, stop = self.arrays["tour_indptr"][sight:sight + 2]
+        tour = self.arrays["tour_indices"][start:stop]
+
+        leg_distances = np.hypot(np.diff(self.x[tour]), np.diff(self.y[tour]))
+        distance = float(leg_distances.sum()) * TRANSPORT_MODES[mode]["detour_factor"]
+        duration = distance / (TRANSPORT_MODES[mode]["speed_kmh"] / 3.6)
+        return self.ids[tour], distance, duration
+
+
+def load_monuments_from_store(store_path: Path, columns: List[str]) -> gpd.GeoDataFrame:
+    """
+    Loads the monuments of a store written by preprocessing as points, with their systemnr in the 'id' column.
+
+    The cleaned shapefile has no systemnr, the store keeps it as the monument id.
+    """
+    store = MonumentStore(store_path)
+    df = store.to_dataframe(columns=columns)
+
+    # Monuments without a geometry have no coordinates in the store
+    df = df[np.isfinite(df["x"]) & np.isfinite(df["y"])]
+    return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df["x"], df["y"]), crs=store.crs)
+
+
+def main():
+    monument_store_path = Path(__file__).resolve().parents[1] / "data" / "output" / "monuments.store"
+    output_path = (
+        Path(__file__).resolve().parents[1] / "data" / "output" / "sevaerdigheder_route_matrix.npz"
+    )
+
+    logger.info(f"Loading monuments from {monument_store_path}...")
+    gdf = load_monuments_from_store(monument_store_path, columns=["sevaerdigh"])
+
+    sevaerdigheder = select_sevaerdigheder(gdf)
+
+    # Keyed by systemnr, the ids of the monument store and the search index
+    build_route_matrix(sevaerdigheder, output_path, id_column="id")
+
+    logger.info("Script completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import bisect
+import pickle
+import re
+import timeit
+import unicodedata
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_processing_utilities import load_csv_as_df, load_csv_with_patches
+from logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+DANISH_FOLDING = str.maketrans({"æ": "ae", "ø": "oe", "å": "aa"})
+NON_ALPHANUMERIC_PATTERN = re.compile(r"[^a-z0-9]+")
+# Separates the 'what' and 'where' parts of queries such as "borg nær Roskilde"
+NEAR_PATTERN = re.compile(r"\s+(?:near|nær|naer)\s+", flags=re.IGNORECASE)
+
+MIN_WORD_LENGTH = 3
+MIN_TRIGRAM_SIMILARITY = 0.4
+
+CATEGORY = "category"
+PLACE = "place"
+
+
+def fold_danish_text(text: str) -> str:
+    """
+    Normalises text for searching: lowercase, æ/ø/å folded to ae/oe/aa, other accents and punctuation removed.
+
+    Folding å to aa also makes the old spelling match, e.g. 'Aalborg' and 'Ålborg' both become 'aalborg'.
+    """
+    text = str(text).lower().translate(DANISH_FOLDING)
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(character for character in text if not unicodedata.combining(character))
+    return NON_ALPHANUMERIC_PATTERN.sub(" ", text).strip()
+
+
+def extract_trigrams(word: str) -> Set[str]:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    In-process search index over the monuments, answering autocomplete and 'X near Y' queries.
+
+    Searchable strings (category labels, their translations and definitions, and place names) are
+    indexed as terms pointing to a category or place code. Words of the terms are kept in a sorted
+    list for prefix lookups and in a trigram inverted index for misspelled queries. Monuments are
+    found through their category and place codes.
+    """
+
+    def __init__(
+        self,
+        monument_ids: np.ndarray,
+        category_codes: np.ndarray,
+        place_codes: np.ndarray,
+        category_labels: List[str],
+        place_labels: List[str],
+    ):
+        self.monument_ids = monument_ids
+        self.category_codes = category_codes
+        self.place_codes = place_codes
+        self.labels = {CATEGORY: category_labels, PLACE: place_labels}
+        self.monument_counts = {
+            CATEGORY: np.bincount(category_codes[category_codes >= 0], minlength=len(category_labels)),
+            PLACE: np.bincount(place_codes[place_codes >= 0], minlength=len(place_labels)),
+        }
+
+        # Postings of every category: monument positions grouped by category code, in CSR format
+        self.category_postings = np.argsort(category_codes, kind="stable")
+        self.category_postings = self.category_postings[category_codes[self.category_postings] >= 0]
+        self.category_indptr = np.concatenate([[0], np.cumsum(self.monument_counts[CATEGORY])])
+
+        # Folded full terms for autocomplete, and folded words for matching query tokens
+        self.terms: List[Tuple[str, str, str, int]] = []
+        self.words: Dict[str, Set[Tuple[str, int]]] = defaultdict(set)
+        self.sorted_terms: List[Tuple[str, int]] = []
+        self.sorted_words: List[str] = []
+        self.trigram_index: Dict[str, List[str]] = defaultdict(list)
+
+    def add_term(self, text: str, kind: str, code: int, index_words: bool = True) -> None:
+        folded_text = fold_danish_text(text)
+        if not folded_text:
+            return
+
+        self.terms.append((folded_text, text, kind, code))
+        if index_words:
+            for word in folded_text.split():
+                if len(word) >= MIN_WORD_LENGTH:
+                    self.words[word].add((kind, code))
+
+    def finalise(self) -> None:
+        """
+        Builds the sorted lookup lists and the trigram index, after all terms are added.
+        """
+        self.sorted_terms = sorted((term[0], term_id) for term_id, term in enumerate(self.terms))
+        self.sorted_words = sorted(self.words)
+        for word in self.sorted_words:
+            for trigram in extract_trigrams(word):
+                self.trigram_index[trigram].append(word)
+
+    def _words_with_prefix(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self.sorted_words, prefix)
+        stop = bisect.bisect_left(self.sorted_words, prefix + "\uffff")
+        return self.sorted_words[start:stop]
+
+    def _similar_words(self, token: str) -> List[str]:
+        token_trigrams = extract_trigrams(token)
+        overlap_counts: Dict[str, int] = defaultdict(int)
+        for trigram in token_trigrams:
+            for word in self.trigram_index.get(trigram, ()):
+                overlap_counts[word] += 1
+
+        return [
+            word
+            for word, overlap in overlap_counts.items()
+            if overlap / (len(token_trigrams) + len(extract_trigrams(word)) - overlap) >= MIN_TRIGRAM_SIMILARITY
+        ]
+
+    def match_codes(self, text: str, kind: str) -> np.ndarray:
+        """
+        Returns the codes of the given kind that match every word of text, by prefix or by trigram similarity.
+        """
+        matched_codes: Optional[Set[int]] = None
+        for token in fold_danish_text(text).split():
+            candidate_words = self._words_with_prefix(token) or self._similar_words(token)
+            token_codes = {
+                code for word in candidate_words for word_kind, code in self.words[word] if word_kind == kind
+            }
+            matched_codes = token_codes if matched_codes is None else matched_codes & token_codes
+            if not matched_codes:
+                break
+
+        return np.array(sorted(matched_codes or ()), dtype=np.int64)
+
+    def autocomplete(self, prefix: str, limit: int = 10) -> List[Tuple[str, str, int]]:
+        """
+        Returns up to limit (label, kind, monument count) suggestions whose term starts with prefix,
+        the most common first.
+        """
+        folded_prefix = fold_danish_text(prefix)
+        start = bisect.bisect_left(self.sorted_terms, (folded_prefix,))
+        stop = bisect.bisect_left(self.sorted_terms, (folded_prefix + "\uffff",))
+
+        suggestions = {}
+        for _, term_id in self.sorted_terms[start:stop]:
+            _, text, kind, code = self.terms[term_id]
+            suggestions[(text, kind)] = int(self.monument_counts[kind][code])
+
+        ranked = sorted(suggestions.items(), key=lambda item: (-item[1], item[0][0]))
+        return [(text, kind, count) for (text, kind), count in ranked[:limit]]
+
+    def search(self, what: str, near: Optional[str] = None, limit: Optional[int] = None) -> pd.DataFrame:
+        """
+        Finds the monuments whose category matches what, optionally restricted to the places matching near.
+
+        Returns:
+            pd.DataFrame: The matching monuments with the columns 'id', 'category' and 'place'.
+        """
+        # Only the postings of the matched categories are visited, not the whole table
+        positions = np.concatenate(
+            [np.empty(0, dtype=np.int64)]
+            + [
+                self.category_postings[self.category_indptr[code]:self.category_indptr[code + 1]]
+                for code in self.match_codes(what, CATEGORY)
+            ]
+        )
+        if near:
+            positions = positions[np.isin(self.place_codes[positions], self.match_codes(near, PLACE))]
+
+        positions = np.sort(positions)[:limit]
+        category_labels = np.array(self.labels[CATEGORY] + [None], dtype=object)
+        place_labels = np.array(self.labels[PLACE] + [None], dtype=object)
+        return pd.DataFrame(
+            {
+                "id": self.monument_ids[positions],
+                "category": category_labels[self.category_codes[positions]],
+                "place": place_labels[self.place_codes[positions]],
+            }
+        )
+
+    def search_query(self, query: str, limit: Optional[int] = None) -> pd.DataFrame:
+        """
+        Parses and answers free text queries such as 'gravhøj nær Roskilde' or 'burial mound near Lejre'.
+        """
+        what, *near = NEAR_PATTERN.split(query, maxsplit=1)
+        return self.search(what, near[0] if near else None, limit=limit)
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+        logger.info(f"Saved search index to {path}")
+
+    @staticmethod
+    def load(path: Path) -> "SearchIndex":
+        with open(path, "rb") as file:
+            return pickle.load(file)
+
+
+def build_search_index(
+    monuments_df: pd.DataFrame,
+    categories_df: Optional[pd.DataFrame] = None,
+    id_column: str = "systemnr",
+    category_column: str = "anlaegsbetydning",
+    place_column: str = "kommunenavn",
+    category_text_columns: Tuple[str, ...] = ("en_anlaegsbetydning", "definition"),
+) -> SearchIndex:
+    """
+    Builds the search index from the monuments table, before the place columns are dropped.
+
+    Parameters:
+        monuments_df (pd.DataFrame): The monuments, one row per monument.
+        categories_df (Optional[pd.DataFrame]): One row per category with extra searchable text,
+            e.g. the translated labels and the generated definitions. Default is None.
+        id_column (str): The column identifying a monument. Defaults to 'systemnr', the row position is used if missing.
+        category_column (str): The category column. Default is 'anlaegsbetydning'.
+        place_column (str): The place name column. Default is 'kommunenavn'.
+        category_text_columns (Tuple[str, ...]): Columns of categories_df indexed as text of the category.
+
+    Returns:
+        SearchIndex: The finalised index.
+    """
+    categories = monuments_df[category_column].astype("category")
+    places = monuments_df[place_column].astype("category")
+    monument_ids = (
+        monuments_df[id_column].to_numpy() if id_column in monuments_df.columns else np.arange(len(monuments_df))
+    )
+
+    index = SearchIndex(
+        monument_ids=monument_ids,
+        category_codes=categories.cat.codes.to_numpy().astype(np.int64),
+        place_codes=places.cat.codes.to_numpy().astype(np.int64),
+        category_labels=[str(label) for label in categories.cat.categories],
+        place_labels=[str(label) for label in places.cat.categories],
+    )
+
+    for code, label in enumerate(index.labels[CATEGORY]):
+        index.add_term(label, CATEGORY, code)
+    for code, label in enumerate(index.labels[PLACE]):
+        index.add_term(label, PLACE, code)
+
+    if categories_df is not None:
+        category_positions = pd.Index(categories.cat.categories).get_indexer(categories_df[category_column])
+        for column in category_text_columns:
+            if column not in categories_df.columns:
+                continue
+            # Translated labels are suggested by autocomplete, long texts such as definitions are only matched by word
+            suggest_full_text = column != "definition"
+            for code, text in zip(category_positions, categories_df[column]):
+                if code >= 0 and isinstance(text, str):
+                    if suggest_full_text:
+                        index.add_term(text, CATEGORY, code)
+                    else:
+                        for word in fold_danish_text(text).split():
+                            if len(word) >= MIN_WORD_LENGTH:
+                                index.words[word].add((CATEGORY, code))
+
+    index.finalise()
+    logger.info(
+        f"Built search index over {len(monument_ids)} monuments with {len(index.terms)} terms "
+        f"and {len(index.sorted_words)} words"
+    )
+    return index
+
+
+def benchmark_search_index(index: SearchIndex, queries: List[str], repeats: int = 100) -> Dict[str, float]:
+    """
+    Measures the throughput of autocomplete and search queries against an index.
+
+    Returns:
+        Dict[str, float]: The queries per second of autocomplete and search.
+    """
+    results = {}
+    for name, run_query in [
+        ("autocomplete", lambda query: index.autocomplete(query[:4])),
+        ("search", lambda query: index.search_query(query)),
+    ]:
+        duration = timeit.timeit(lambda: [run_query(query) for query in queries], number=repeats)
+        results[name] = len(queries) * repeats / duration
+        logger.info(
+            f"{name}: {results[name]:.0f} queries/second ({duration / (len(queries) * repeats) * 1000:.3f} ms per query)"
+        )
+    return results
+
+
+def main():
+    input_csv_path = (
+        Path(__file__).resolve().parents[1] / "data" / "input" / "anlaeg_all_25832.csv"
+    )
+    definitions_csv_path = (
+        Path(__file__).resolve().parents[1] / "data" / "output" / "anlaegsbetydning_with_definitions.csv"
+    )
+    output_path = Path(__file__).resolve().parents[1] / "data" / "output" / "search_index.pkl"
+
+    df = load_csv_as_df(
+        input_csv_path,
+        csv_encoding="ISO-8859-1",
+        column_dtypes={"anlaegsbetydning": "category", "kommunenavn": "category"},
+    )
+    categories_df = (
+        load_csv_with_patches(definitions_csv_path, key_column="anlaegsbetydning") if definitions_csv_path.exists() else None
+    )
+
+    index = build_search_index(df, categories_df)
+    index.save(output_path)
+
+    benchmark_search_index(
+        index, ["gravhøj", "gravhoej nær Roskilde", "rundhøj nær Lejre", "burial mound near Aalborg", "borg"]
+    )
+
+
+if __name__ == "__main__":
+    main()
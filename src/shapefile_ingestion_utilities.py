@@ -0,0 +1,145 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import fiona
+import geopandas as gpd
+import pandas as pd
+
+from code_utilities import timing_decorator
+from logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+def count_features(input_path: Path) -> Tuple[int, List[str]]:
+    """
+    Reads the number of features and the attribute names of a layer, without loading any features.
+    """
+    with fiona.open(input_path) as source:
+        return len(source), list(source.schema["properties"])
+
+
+def split_feature_ranges(feature_count: int, partition_count: int) -> List[slice]:
+    """
+    Splits the feature ids 0..feature_count into partition_count contiguous ranges of (almost) equal size.
+    """
+    partition_count = max(1, min(partition_count, feature_count))
+    boundaries = [round(i * feature_count / partition_count) for i in range(partition_count + 1)]
+    return [slice(start, stop) for start, stop in zip(boundaries[:-1], boundaries[1:])]
+
+
+def read_shapefile_partition(
+    input_path: Path,
+    rows: slice,
+    columns_to_remove: List[str],
+    target_crs: Optional[str] = None,
+    join_df: Optional[pd.DataFrame] = None,
+    join_on: Optional[str] = None,
+    partition_output_path: Optional[Path] = None,
+) -> gpd.GeoDataFrame:
+    """
+    Reads one feature id range of a layer and applies the per-partition transforms.
+
+    Parameters:
+        input_path (Path): The path of the layer to read.
+        rows (slice): The feature id range to read.
+        columns_to_remove (List[str]): Attributes that are never read from disk.
+        target_crs (Optional[str]): CRS to reproject the partition to. Default is None, which keeps the CRS.
+        join_df (Optional[pd.DataFrame]): Attributes to left join onto the partition. Default is None.
+        join_on (Optional[str]): The column to join join_df on. Required if join_df is given.
+        partition_output_path (Optional[Path]): If given, the partition is also written to this path.
+
+    Returns:
+        gpd.GeoDataFrame: The transformed partition.
+    """
+    # Column projection, ignored fields are skipped by the driver instead of being dropped after loading
+    gdf = gpd.read_file(input_path, rows=rows, ignore_fields=columns_to_remove)
+
+    if target_crs is not None:
+        gdf = gdf.to_crs(target_crs)
+
+    if join_df is not None:
+        gdf = gdf.merge(join_df, on=join_on, how="left")
+
+    if partition_output_path is not None:
+        gdf.to_file(partition_output_path, driver="ESRI Shapefile")
+
+    return gdf
+
+
+@timing_decorator(logger=logger)
+def read_shapefile_in_parallel(
+    input_path: Path,
+    columns_to_remove: List[str],
+    num_workers: Optional[int] = None,
+    partitions_per_worker: int = 2,
+    target_crs: Optional[str] = None,
+    join_df: Optional[pd.DataFrame] = None,
+    join_on: Optional[str] = None,
+    partition_output_dir: Optional[Path] = None,
+) -> gpd.GeoDataFrame:
+    """
+    Reads a layer with a process pool, split into contiguous feature id ranges.
+
+    The partitions are combined in feature id order, so the result is identical to reading
+    the whole layer with gpd.read_file and applying the same transforms.
+
+    Parameters:
+        input_path (Path): The path of the layer to read.
+        columns_to_remove (List[str]): Attributes to leave out. Attributes missing from the layer are skipped.
+        num_workers (Optional[int]): The number of worker processes. Defaults to the number of CPU cores.
+        partitions_per_worker (int): Partitions per worker, smaller partitions balance the load better. Default is 2.
+        target_crs (Optional[str]): CRS to reproject to. Default is None, which keeps the CRS.
+        join_df (Optional[pd.DataFrame]): Attributes to left join onto every partition. Default is None.
+        join_on (Optional[str]): The column to join join_df on. Required if join_df is given.
+        partition_output_dir (Optional[Path]): If given, every partition is also written to this directory.
+
+    Returns:
+        gpd.GeoDataFrame: The combined layer.
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    feature_count, attribute_names = count_features(input_path)
+
+    missing_columns = [column for column in columns_to_remove if column not in attribute_names]
+    for column in missing_columns:
+        logger.error(f"Column {column} not found in {input_path}. Skipping this column.")
+    columns_to_remove = [column for column in columns_to_remove if column in attribute_names]
+
+    partitions = split_feature_ranges(feature_count, num_workers * partitions_per_worker)
+    logger.info(
+        f"Reading {feature_count} features from {input_path} in {len(partitions)} partitions "
+        f"with {num_workers} worker processes..."
+    )
+
+    if partition_output_dir is not None:
+        partition_output_dir.mkdir(parents=True, exist_ok=True)
+        partition_output_paths = [
+            partition_output_dir / f"{input_path.stem}_part_{partition_id}.shp"
+            for partition_id in range(len(partitions))
+        ]
+    else:
+        partition_output_paths = [None] * len(partitions)
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        partition_gdfs = list(
+            executor.map(
+                read_shapefile_partition,
+                [input_path] * len(partitions),
+                partitions,
+                [columns_to_remove] * len(partitions),
+                [target_crs] * len(partitions),
+                [join_df] * len(partitions),
+                [join_on] * len(partitions),
+                partition_output_paths,
+            )
+        )
+
+    # Keep the CRS even if every partition is empty
+    gdf = gpd.GeoDataFrame(pd.concat(partition_gdfs, ignore_index=True), crs=partition_gdfs[0].crs)
+    logger.info(f"Combined {len(partition_gdfs)} partitions into {len(gdf)} features")
+
+    return gdf
@@ -0,0 +1,37 @@
+import os
+from pathlib import Path
+
+from add_icons_pipeline import translate_long_text_column_dk_to_en
+from data_processing_utilities import compact_csv_patches, export_df_as_csv, load_csv_as_df
+from logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+def main():
+    definitions_csv_path = (
+        Path(__file__).resolve().parents[1] / "data" / "output" / "anlaegsbetydning_with_definitions.csv"
+    )
+
+    # Fold pending patches into the CSV file first, the file is rewritten as a whole below.
+    # Regenerated definitions have their en_definition cleared, so only they are translated again
+    compact_csv_patches(definitions_csv_path, key_column="anlaegsbetydning")
+
+    df = load_csv_as_df(definitions_csv_path, csv_encoding="utf-8")
+
+    # Store the English definitions next to the Danish ones, so popups can be served in both languages
+    # One model instance per core, finished shards are checkpointed so a stopped run resumes
+    df = translate_long_text_column_dk_to_en(
+        df,
+        column_to_translate="definition",
+        num_workers=os.cpu_count() or 1,
+        checkpoint_dir=Path(__file__).resolve().parents[1] / "data" / "output" / "temp" / "translation_shards",
+    )
+
+    export_df_as_csv(df, definitions_csv_path.parent, definitions_csv_path.name)
+
+    logger.info("Script completed!")
+
+
+if __name__ == "__main__":
+    main()
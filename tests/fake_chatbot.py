@@ -0,0 +1,52 @@
+import time
+from typing import List
+
+
+class FakeMessage:
+    def __init__(self, text: str, latency_seconds: float):
+        self.text = text
+        self.latency_seconds = latency_seconds
+
+    def wait_until_done(self) -> None:
+        time.sleep(self.latency_seconds)
+
+    def get_final_text(self) -> str:
+        return self.text
+
+    def search_enabled(self) -> bool:
+        return False
+
+    def get_search_sources(self) -> list:
+        return []
+
+
+class FakeChatBot:
+    """
+    Stand-in for hugchat.ChatBot that plays back scripted outcomes: 'ok', 'hang', 'retryable' or 'fatal'.
+
+    The last outcome repeats once the script is used up. Every chat call is recorded with the
+    conversation it was sent to.
+    """
+
+    def __init__(self, outcomes: List[str], latency_seconds: float = 0.0, hang_seconds: float = 0.5):
+        self.active_model = "fake-model"
+        self.outcomes = list(outcomes)
+        self.latency_seconds = latency_seconds
+        self.hang_seconds = hang_seconds
+        self.conversation = 0
+        self.calls: List[int] = []
+
+    def new_conversation(self, switch_to: bool = False) -> None:
+        self.conversation += 1
+
+    def chat(self, prompt: str, web_search: bool = False) -> FakeMessage:
+        outcome = self.outcomes[min(len(self.calls), len(self.outcomes) - 1)]
+        self.calls.append(self.conversation)
+
+        if outcome == "fatal":
+            raise ValueError("Invalid prompt")
+        if outcome == "retryable":
+            raise ConnectionError("503 Service Unavailable: model overloaded")
+        if outcome == "hang":
+            return FakeMessage(f"Answer to {prompt}", self.hang_seconds)
+        return FakeMessage(f"Answer to {prompt}", self.latency_seconds)
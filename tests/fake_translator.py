@@ -0,0 +1,21 @@
+from typing import Dict, List, Optional
+
+
+class FakeTranslator:
+    """
+    Stand-in for the transformers TranslationPipeline that prefixes every text, and fails on texts
+    containing fail_on to simulate a run that is killed part way.
+    """
+
+    def __init__(self, prefix: str, fail_on: Optional[str] = None):
+        self.prefix = prefix
+        self.fail_on = fail_on
+
+    def __call__(self, texts: List[str], batch_size: int = 1) -> List[Dict[str, str]]:
+        if self.fail_on is not None and any(self.fail_on in text for text in texts):
+            raise RuntimeError(f"Translation stopped at {self.fail_on}")
+        return [{"translation_text": f"{self.prefix}:{text}"} for text in texts]
+
+
+def create_fake_translator(prefix: str, fail_on: Optional[str] = None) -> FakeTranslator:
+    return FakeTranslator(prefix, fail_on)
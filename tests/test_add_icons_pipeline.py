@@ -0,0 +1,68 @@
+from functools import partial
+
+import pytest
+
+from add_icons_pipeline import batch_by_token_limit, split_into_sentences, translate_texts_sharded
+from fake_translator import create_fake_translator
+
+TEXTS = ["Gravhøj fra oldtiden.", "Kirken brændte.", "Voldsted ved åen."]
+
+
+def test_sharded_translation_resumes_from_completed_shards(tmp_path):
+    checkpoint_dir = tmp_path / "translation_shards"
+
+    # The first run dies on the second shard, the other shards are checkpointed
+    with pytest.raises(RuntimeError):
+        translate_texts_sharded(
+            TEXTS,
+            num_workers=2,
+            shard_size=1,
+            checkpoint_dir=checkpoint_dir,
+            translator_factory=partial(create_fake_translator, "first", fail_on="brændte"),
+        )
+    assert len(list(checkpoint_dir.glob("*.json"))) == 2
+
+    translations = translate_texts_sharded(
+        TEXTS,
+        num_workers=2,
+        shard_size=1,
+        checkpoint_dir=checkpoint_dir,
+        translator_factory=partial(create_fake_translator, "second"),
+    )
+
+    assert translations == [f"first:{TEXTS[0]}", f"second:{TEXTS[1]}", f"first:{TEXTS[2]}"]
+
+
+def test_split_into_sentences_keeps_abbreviations():
+    text = "Høj fra ca. 3000 f.Kr. Bygget af jord. Den blev udgravet fx. i 1890! Hvor? 12 grave blev fundet."
+
+    assert split_into_sentences(text) == [
+        "Høj fra ca. 3000 f.Kr. Bygget af jord.",
+        "Den blev udgravet fx. i 1890!",
+        "Hvor?",
+        "12 grave blev fundet.",
+    ]
+
+
+def test_split_into_sentences_ignores_blank_text():
+    assert split_into_sentences("   ") == []
+
+
+def test_batch_by_token_limit_keeps_batches_within_the_limit():
+    assert batch_by_token_limit([3, 3, 3, 5, 9, 1], max_tokens_per_batch=6) == [[0, 1], [2], [3], [4], [5]]
+
+
+def test_sharded_translation_uses_token_limited_shards(tmp_path):
+    checkpoint_dir = tmp_path / "translation_shards"
+
+    translations = translate_texts_sharded(
+        TEXTS,
+        num_workers=2,
+        checkpoint_dir=checkpoint_dir,
+        translator_factory=partial(create_fake_translator, "en"),
+        token_counts=[4, 2, 5],
+        max_tokens_per_batch=6,
+    )
+
+    assert translations == [f"en:{text}" for text in TEXTS]
+    assert len(list(checkpoint_dir.glob("*.json"))) == 2
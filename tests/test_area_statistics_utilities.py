@@ -0,0 +1,35 @@
+import json
+
+import geopandas as gpd
+from shapely.geometry import Point, Polygon
+
+from area_statistics_utilities import assign_grid_cells, build_area_statistics
+
+
+def make_monuments() -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame(
+        {"datering": ["Oldtid", None, "Oldtid"], "kommunenav": ["Lejre", "Vejle", "Lejre"]},
+        geometry=[Point(500100, 6200100), Point(510000, 6210000), Polygon()],
+        crs="EPSG:25832",
+    )
+
+
+def test_empty_geometries_get_no_grid_cell():
+    cells = assign_grid_cells(make_monuments())
+
+    assert cells.tolist()[:2] == ["10km_620_50", "10km_621_51"]
+    assert cells.isna().tolist() == [False, False, True]
+    assert list(cells.cat.categories) == ["10km_620_50", "10km_621_51"]
+
+
+def test_area_statistics_are_valid_json(tmp_path):
+    output_path = tmp_path / "area_statistics.json"
+
+    build_area_statistics(make_monuments(), output_path)
+
+    def reject_constant(constant):
+        raise ValueError(f"Invalid JSON constant {constant}")
+
+    lookup = json.loads(output_path.read_text(encoding="utf-8"), parse_constant=reject_constant)
+    assert lookup["kommunenav"]["Lejre"]["counts"] == 2
+    assert lookup["kommunenav"]["Vejle"]["most_frequent_datering"] is None
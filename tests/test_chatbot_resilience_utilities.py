@@ -0,0 +1,114 @@
+import time
+
+import pytest
+
+from chatbot_resilience_utilities import (
+    CircuitBreaker,
+    GENERATION_STATUS_FATAL_ERROR,
+    GENERATION_STATUS_RETRIES_EXHAUSTED,
+    GENERATION_STATUS_TIMEOUT,
+    RetriesExhaustedError,
+    call_with_retries,
+    generation_status_from_error,
+    is_retryable_error,
+)
+from fake_chatbot import FakeChatBot
+
+FAST_RETRIES = {"timeout_seconds": 0.1, "base_delay_seconds": 0.0, "max_delay_seconds": 0.0}
+
+
+def prompt(chatbot: FakeChatBot) -> str:
+    message = chatbot.chat("prompt")
+    message.wait_until_done()
+    return message.get_final_text()
+
+
+def test_success_is_returned_without_retries():
+    chatbot = FakeChatBot(["ok"])
+
+    assert call_with_retries(prompt, chatbot, max_retries=3, **FAST_RETRIES) == "Answer to prompt"
+    assert len(chatbot.calls) == 1
+
+
+def test_hang_produces_timeout_status():
+    chatbot = FakeChatBot(["hang"])
+
+    with pytest.raises(RetriesExhaustedError) as error:
+        call_with_retries(prompt, chatbot, max_retries=1, **FAST_RETRIES)
+
+    assert generation_status_from_error(error.value) == GENERATION_STATUS_TIMEOUT
+    assert len(chatbot.calls) == 2
+
+
+def test_retry_after_timeout_uses_new_conversation():
+    chatbot = FakeChatBot(["hang", "ok"])
+
+    result = call_with_retries(prompt, chatbot, max_retries=1, on_timeout=chatbot.new_conversation, **FAST_RETRIES)
+
+    assert result == "Answer to prompt"
+    assert chatbot.calls == [0, 1]
+
+
+def test_retryable_errors_are_retried_max_retries_times():
+    chatbot = FakeChatBot(["retryable"])
+
+    with pytest.raises(RetriesExhaustedError) as error:
+        call_with_retries(prompt, chatbot, max_retries=3, **FAST_RETRIES)
+
+    assert generation_status_from_error(error.value) == GENERATION_STATUS_RETRIES_EXHAUSTED
+    assert len(chatbot.calls) == 4
+
+
+def test_retryable_error_recovers():
+    chatbot = FakeChatBot(["retryable", "retryable", "ok"])
+
+    assert call_with_retries(prompt, chatbot, max_retries=3, **FAST_RETRIES) == "Answer to prompt"
+    assert len(chatbot.calls) == 3
+
+
+def test_fatal_errors_are_not_retried():
+    chatbot = FakeChatBot(["fatal", "ok"])
+
+    with pytest.raises(ValueError) as error:
+        call_with_retries(prompt, chatbot, max_retries=3, **FAST_RETRIES)
+
+    assert generation_status_from_error(error.value) == GENERATION_STATUS_FATAL_ERROR
+    assert len(chatbot.calls) == 1
+
+
+def test_circuit_breaker_opens_and_closes():
+    circuit_breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=0.2)
+    chatbot = FakeChatBot(["retryable", "retryable", "ok"])
+
+    with pytest.raises(RetriesExhaustedError):
+        call_with_retries(prompt, chatbot, max_retries=1, circuit_breaker=circuit_breaker, **FAST_RETRIES)
+    assert circuit_breaker.is_open
+
+    # The next call waits out the cooldown, and its success closes the breaker
+    start = time.monotonic()
+    assert call_with_retries(prompt, chatbot, max_retries=1, circuit_breaker=circuit_breaker, **FAST_RETRIES)
+    assert time.monotonic() - start >= 0.15
+    assert not circuit_breaker.is_open
+
+
+class HTTPError(Exception):
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@pytest.mark.parametrize(
+    "error, retryable",
+    [
+        (Exception("503 Service Unavailable"), True),
+        (Exception("Request failed with status 429"), True),
+        (Exception("Model is overloaded, try again"), True),
+        (Exception("Prompt exceeds the limit of 1500 tokens"), False),
+        (Exception("Conversation req-503-ab not found"), False),
+        (Exception("Invalid id 5033"), False),
+        (HTTPError("Server error 503", status_code=400), False),
+        (HTTPError("Bad gateway", status_code=502), True),
+    ],
+)
+def test_status_codes_are_matched_as_whole_codes(error, retryable):
+    assert is_retryable_error(error) == retryable
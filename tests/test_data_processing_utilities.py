@@ -0,0 +1,65 @@
+import pandas as pd
+
+from data_processing_utilities import KeyedTable, get_patch_file_path, load_csv_with_patches, persist_upserted_rows
+
+VALUE_COLUMNS = ["definition", "generation_status"]
+
+
+def make_table() -> KeyedTable:
+    master_df = pd.DataFrame({"anlaegsbetydning": ["Gravhøj", "Kirke"], "counts": [3, 2]})
+    return KeyedTable(master_df, "anlaegsbetydning", VALUE_COLUMNS)
+
+
+def test_upsert_updates_changed_rows_only():
+    table = make_table()
+    updates_df = pd.DataFrame(
+        {"anlaegsbetydning": ["Gravhøj", "Kirke"], "definition": ["En høj", None], "generation_status": ["success", None]}
+    )
+
+    updated_rows, inserted_rows = table.upsert(updates_df)
+
+    assert list(updated_rows["anlaegsbetydning"]) == ["Gravhøj"]
+    assert inserted_rows.empty
+    assert list(table.df["version"]) == [1, 0]
+
+
+def test_inserted_rows_keep_columns_and_dtypes():
+    table = make_table()
+    updates_df = pd.DataFrame(
+        {"anlaegsbetydning": ["Voldsted"], "counts": [7], "definition": ["Et voldsted"], "generation_status": ["success"]}
+    )
+
+    _, inserted_rows = table.upsert(updates_df)
+
+    assert len(inserted_rows) == 1
+    assert table.df["counts"].dtype == "int64"
+    assert table.df.loc[table.positions["Voldsted"], "counts"] == 7
+    assert table.positions["Voldsted"] == 2
+
+
+def test_dependent_columns_are_cleared_for_changed_rows():
+    master_df = pd.DataFrame(
+        {"anlaegsbetydning": ["Gravhøj", "Kirke"], "definition": ["En høj", "En kirke"], "en_definition": ["A mound", "A church"]}
+    )
+    table = KeyedTable(master_df, "anlaegsbetydning", ["definition"], dependent_columns=["en_definition"])
+
+    table.upsert(pd.DataFrame({"anlaegsbetydning": ["Gravhøj", "Kirke"], "definition": ["En gravhøj", "En kirke"]}))
+
+    assert table.df["en_definition"].isna().tolist() == [True, False]
+
+
+def test_persisted_patches_round_trip_danish_text(tmp_path):
+    file_path = tmp_path / "anlaegsbetydning_with_definitions.csv"
+    table = make_table()
+    persist_upserted_rows(table.df, *table.upsert(table.df), file_path)
+
+    updates_df = pd.DataFrame(
+        {"anlaegsbetydning": ["Kirke"], "definition": ["Kirken brændte"], "generation_status": ["success"]}
+    )
+    persist_upserted_rows(table.df, *table.upsert(updates_df), file_path)
+    assert get_patch_file_path(file_path).exists()
+
+    loaded_df = load_csv_with_patches(file_path, key_column="anlaegsbetydning")
+
+    assert list(loaded_df["anlaegsbetydning"]) == ["Gravhøj", "Kirke"]
+    assert loaded_df.loc[1, "definition"] == "Kirken brændte"
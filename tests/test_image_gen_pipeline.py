@@ -0,0 +1,46 @@
+import pandas as pd
+
+from fake_chatbot import FakeChatBot
+from image_gen_pipeline import generate_image_prompts_from_dataframe
+
+
+def generate(df: pd.DataFrame, results_path) -> tuple:
+    chatbot = FakeChatBot(["ok"])
+    results_df = generate_image_prompts_from_dataframe(
+        df,
+        key_column="anlaegsbetydning",
+        source_column="definition",
+        chatbot_factory=lambda: chatbot,
+        results_path=results_path,
+        max_concurrency=1,
+    )
+    return results_df, chatbot
+
+
+def test_only_items_with_a_changed_source_are_generated_again(tmp_path):
+    results_path = tmp_path / "image_prompts.csv"
+    df = pd.DataFrame({"anlaegsbetydning": ["Gravhøj", "Kirke"], "definition": ["En høj", "En kirke"]})
+    _, chatbot = generate(df, results_path)
+    assert len(chatbot.calls) == 4
+
+    df.loc[1, "definition"] = "En kirke der brændte"
+    results_df, chatbot = generate(df, results_path)
+
+    # One description and one image prompt, for the changed definition only
+    assert len(chatbot.calls) == 2
+    kirke = results_df.set_index("anlaegsbetydning").loc["Kirke"]
+    assert "brændte" in kirke["description"]
+
+
+def test_results_without_source_hash_are_generated_again(tmp_path):
+    results_path = tmp_path / "image_prompts.csv"
+    pd.DataFrame(
+        {"anlaegsbetydning": ["Gravhøj"], "description": ["Gammel"], "image_prompt": ["Gammel"], "generation_status": ["success"]}
+    ).to_csv(results_path, index=False, encoding="utf-8")
+    df = pd.DataFrame({"anlaegsbetydning": ["Gravhøj"], "definition": ["En høj"]})
+
+    results_df, chatbot = generate(df, results_path)
+
+    assert len(chatbot.calls) == 2
+    assert results_df["source_hash"].notna().all()
+    assert list(pd.read_csv(results_path).columns) == ["anlaegsbetydning", "source_hash", "description", "image_prompt", "generation_status"]
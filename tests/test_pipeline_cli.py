@@ -0,0 +1,39 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from pipeline_cli import IMPORT_TIME_BUDGET_SECONDS, NON_ML_MODULES, measure_import_times
+
+PIPELINE_CLI_PATH = Path(__file__).resolve().parents[1] / "src" / "pipeline_cli.py"
+
+
+def run_cli(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, str(PIPELINE_CLI_PATH), *args], capture_output=True, text=True, timeout=60
+    )
+
+
+@pytest.mark.parametrize("module_name", NON_ML_MODULES)
+def test_non_ml_module_imports_within_budget(module_name):
+    # The first import writes the bytecode cache, the budget applies to the imports after it
+    measure_import_times(module_name)
+    import_seconds, _ = measure_import_times(module_name)
+
+    assert import_seconds < IMPORT_TIME_BUDGET_SECONDS
+
+
+@pytest.mark.parametrize("command", ["route-matrix", "definitions", "preprocess", "image-prompts"])
+def test_help_does_not_run_pipeline(command):
+    completed = run_cli(command, "--help")
+
+    assert completed.returncode == 0
+    assert completed.stdout.startswith(f"usage: pipeline_cli.py {command}")
+
+
+def test_extra_arguments_are_rejected_for_pipelines_without_arguments():
+    completed = run_cli("route-matrix", "--max-distance", "100")
+
+    assert completed.returncode == 2
+    assert "unrecognized arguments" in completed.stderr
@@ -0,0 +1,66 @@
+import geopandas as gpd
+import pytest
+from geopandas.testing import assert_geodataframe_equal
+from shapely.geometry import Point
+
+from preprocess_data import filter_out_unnecessary_columns
+
+
+@pytest.fixture
+def monuments_shapefile(tmp_path):
+    gdf = gpd.GeoDataFrame(
+        {
+            "systemnr": [101, 102, 103, 104],
+            "anlaegsbet": ["Gravhøj", "Kirke", "Gravhøj", "Voldsted"],
+            "datering": ["Oldtid", "Middelalder", "Bronzealder", "Middelalder"],
+            "kommunenav": ["Aarhus", "Aarhus", "Odense", "Odense"],
+            "dateringsk": ["A", "B", "C", "B"],
+            "sevaerdigh": ["1", None, "2", None],
+        },
+        geometry=[Point(575_000, 6_225_000), Point(576_000, 6_226_000), Point(590_000, 6_140_000), Point(591_000, 6_141_000)],
+        crs="EPSG:25832",
+    )
+    input_path = tmp_path / "anlaeg.shp"
+    gdf.to_file(input_path, driver="ESRI Shapefile")
+    return input_path
+
+
+def test_removed_columns_are_matched_by_their_truncated_names(monuments_shapefile, tmp_path):
+    output_path = tmp_path / "cleaned.shp"
+
+    filter_out_unnecessary_columns(
+        monuments_shapefile,
+        ["systemnr", "dateringskode", "kommunenavn", "kommunenr"],
+        output_path,
+        area_statistics_output_path=tmp_path / "area_statistics.json",
+        id_column="systemnr",
+    )
+
+    exported_columns = set(gpd.read_file(output_path).columns)
+    assert "kommunenav" not in exported_columns
+    assert "dateringsk" not in exported_columns
+    assert "systemnr" not in exported_columns
+    assert "sevaerdigh" in exported_columns
+
+
+def test_parallel_read_matches_serial_read(monuments_shapefile, tmp_path):
+    columns_to_remove = ["systemnr", "dateringskode", "kommunenavn"]
+    results = {}
+    for num_workers in (1, 2):
+        output_path = tmp_path / f"cleaned_{num_workers}.shp"
+        gdf = filter_out_unnecessary_columns(
+            monuments_shapefile,
+            columns_to_remove,
+            output_path,
+            num_workers=num_workers,
+            partition_output_dir=tmp_path / f"partitions_{num_workers}",
+            area_statistics_output_path=tmp_path / f"area_statistics_{num_workers}.json",
+            id_column="systemnr",
+        )
+        results[num_workers] = (gdf, gpd.read_file(output_path), (tmp_path / f"area_statistics_{num_workers}.json").read_text())
+
+    serial_gdf, serial_export, serial_statistics = results[1]
+    parallel_gdf, parallel_export, parallel_statistics = results[2]
+    assert_geodataframe_equal(parallel_gdf.reset_index(drop=True), serial_gdf.reset_index(drop=True))
+    assert_geodataframe_equal(parallel_export, serial_export)
+    assert parallel_statistics == serial_statistics
@@ -0,0 +1,30 @@
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import Point
+
+from monument_store_utilities import write_monument_store
+from route_matrix_pipeline import (
+    TRANSPORT_MODES,
+    RouteMatrix,
+    build_route_matrix,
+    load_monuments_from_store,
+    select_sevaerdigheder,
+)
+
+
+def test_route_matrix_is_keyed_by_systemnr(tmp_path):
+    gdf = gpd.GeoDataFrame(
+        {"systemnr": [5001, 5002, 5003, 5004], "sevaerdigh": ["1", None, "2", "1"]},
+        geometry=[Point(575_000, 6_225_000), Point(576_000, 6_226_000), Point(577_000, 6_225_500), Point()],
+        crs="EPSG:25832",
+    )
+    store_path = tmp_path / "monuments.store"
+    write_monument_store(gdf, store_path, id_column="systemnr")
+
+    sevaerdigheder = select_sevaerdigheder(load_monuments_from_store(store_path, columns=["sevaerdigh"]))
+    build_route_matrix(sevaerdigheder, tmp_path / "route_matrix.npz", id_column="id")
+
+    route_matrix = RouteMatrix(tmp_path / "route_matrix.npz")
+    assert route_matrix.ids.tolist() == [5001, 5003]
+    assert route_matrix.neighbours(0)["id"].tolist() == [5003]
+    assert np.isclose(route_matrix.travel(0, 1)[0], np.hypot(2000, 500) * TRANSPORT_MODES["driving"]["detour_factor"])